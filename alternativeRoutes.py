@@ -0,0 +1,182 @@
+from heapq import heappush, heappop
+from math import inf
+from dijkstra import ShortestPathTree, one_to_all
+from search import SearchSpace, astar_search
+from spatialIndex import snap
+
+
+def alternative_routes(graph, source, destination, k=3, stretch=0.25, sharing=0.8, plateau=0.25):
+    """
+    Alternative routes with the via node method. One Dijkstra tree grows from source and one towards destination,
+    both only as far as (1 + stretch) times the optimal cost. Every node settled by both is the via node of a route
+    made of its two tree paths. Routes through the same plateau, a stretch where both trees follow the same arcs,
+    are identical, so every plateau is considered once. Long plateaus make routes that are locally optimal,
+    a detour around any stretch shorter than the plateau does not pay off.
+
+    Parameters:
+    - graph: Graph or CSRGraph with reversed edges.
+    - source: Node the routes start from, or a (lat, long) tuple in degrees snapped to the nearest node.
+    - destination: Node the routes lead to, or a (lat, long) tuple in degrees.
+    - k: Number of routes at most, the optimal one included.
+    - stretch: A route costs at most (1 + stretch) times the optimal cost.
+    - sharing: A route shares at most this fraction of the optimal cost with the routes picked before it.
+    - plateau: A route has a plateau of at least this fraction of the optimal cost.
+
+    Returns:
+    - List of (path tuple, cost) sorted by cost, empty if destination can not be reached.
+    """
+    source, destination = snap(graph, source), snap(graph, destination)
+    forward = ShortestPathTree(graph, source)
+    best = forward.settle_until(destination)
+    if best == inf:
+        return []
+    routes = [(forward.path(destination), best)]
+    if k < 2 or source == destination:
+        return translated(graph, routes)
+
+    limit = (1 + stretch) * best
+    backward = ShortestPathTree(graph.reverse(), destination)
+    forward.settle_within(limit)
+    backward.settle_within(limit)
+    forward_distance, forward_parent = forward.distance, forward.parent
+    backward_distance, backward_parent = backward.distance, backward.parent
+    both = forward.settled & backward.settled
+
+    # Every plateau once, as (route cost, -plateau length, last node of the plateau)
+    candidates = []
+    visited = set()
+    for node in both:
+        if node in visited or forward_distance[node] + backward_distance[node] > limit:
+            continue
+        # The plateau runs towards source while the backward tree takes the same arcs the other way
+        first = node
+        while forward_parent[first] in both and backward_parent[forward_parent[first]] == first:
+            first = forward_parent[first]
+        last = node
+        while backward_parent[last] in both and forward_parent[backward_parent[last]] == last:
+            last = backward_parent[last]
+        length = forward_distance[last] - forward_distance[first]
+        step = last
+        while True:
+            visited.add(step)
+            if step == first:
+                break
+            step = forward_parent[step]
+        if length >= plateau * best:
+            heappush(candidates, (forward_distance[last] + backward_distance[last], -length, last))
+
+    # Arcs of the routes picked so far
+    used = set(zip(routes[0][0], routes[0][0][1:]))
+    while candidates and len(routes) < k:
+        cost, _, via = heappop(candidates)
+        path = forward.path(via) + backward.path(via)[::-1][1:]
+        if len(set(path)) < len(path):
+            # Both tree paths pass some other node, the route has a loop
+            continue
+        arcs = list(zip(path, path[1:]))
+        shared = sum(graph.path_cost(tail, head) for tail, head in arcs if (tail, head) in used)
+        if shared > sharing * best:
+            continue
+        routes.append((path, cost))
+        used.update(arcs)
+    return translated(graph, routes)
+
+
+class SpurGraph:
+
+    def __init__(self, graph, blocked_nodes, blocked_arcs):
+        """
+        View of a graph without some nodes and arcs, for the spur searches of k_shortest_paths.
+        """
+        self.graph = graph
+        self.blocked_nodes = blocked_nodes
+        self.blocked_arcs = blocked_arcs
+        self.original_ids = None
+
+    def neighbors(self, node_value):
+        blocked_nodes = self.blocked_nodes
+        blocked_arcs = self.blocked_arcs
+        return [(neighbor, cost) for neighbor, cost in self.graph.neighbors(node_value)
+                if neighbor not in blocked_nodes and (node_value, neighbor) not in blocked_arcs]
+
+
+def k_shortest_paths(graph, source, destination, k=3):
+    """
+    The k shortest loopless paths with Yen's algorithm. Every path found so far gets a spur search from each of its
+    nodes, avoiding the nodes before it and the arcs the shorter paths with the same start take from it.
+    One Dijkstra on the reversed graph gives the exact distance of every node to destination. That is both the
+    heuristic of the spur searches, so they expand little more than the path they find, and a shortest path tree
+    whose path is taken as it is whenever nothing blocks it.
+
+    Parameters:
+    - graph: Graph or CSRGraph with reversed edges.
+    - source: Node the paths start from, or a (lat, long) tuple in degrees snapped to the nearest node.
+    - destination: Node the paths lead to, or a (lat, long) tuple in degrees.
+    - k: Number of paths.
+
+    Returns:
+    - List of (path tuple, cost) sorted by cost, fewer than k when there are not as many loopless paths.
+    """
+    source, destination = snap(graph, source), snap(graph, destination)
+    to_destination, next_node = one_to_all(graph.reverse(), destination, parents=True)
+    to_destination = to_destination.tolist()
+    next_node = next_node.tolist()
+    if to_destination[source] == inf:
+        return []
+
+    def tree_path(node, blocked_nodes=(), blocked_arcs=()):
+        # Path along the tree to destination, None if it runs into something blocked
+        path = [node]
+        while node != destination:
+            if (node, next_node[node]) in blocked_arcs:
+                return None
+            node = next_node[node]
+            if node in blocked_nodes:
+                return None
+            path.append(node)
+        return tuple(path)
+
+    def potential(nodes):
+        return [to_destination[node] for node in nodes]
+
+    space = SearchSpace(graph.num_nodes)
+    paths = [(tree_path(source), to_destination[source])]
+    found = {paths[0][0]}
+    candidates = []
+    while len(paths) < k:
+        last = paths[-1][0]
+        root_cost = 0
+        for i, spur in enumerate(last[:-1]):
+            root = last[:i + 1]
+            blocked_arcs = {(spur, path[i + 1]) for path, _ in paths if path[:i + 1] == root}
+            blocked_nodes = set(root[:-1])
+            spur_path = tree_path(spur, blocked_nodes, blocked_arcs)
+            if spur_path is not None:
+                spur_cost = to_destination[spur]
+            else:
+                result = astar_search(SpurGraph(graph, blocked_nodes, blocked_arcs), space, spur, destination, potential)
+                if result is not None:
+                    # solution() keeps the retraced path, so the next reset of space does not walk it again.
+                    # SpurGraph has no original_ids, the path stays in the ids of graph
+                    spur_path, spur_cost = result.solution(), result.path_cost
+            if spur_path is not None:
+                path = root[:-1] + spur_path
+                if path not in found:
+                    found.add(path)
+                    heappush(candidates, (root_cost + spur_cost, path))
+            root_cost += graph.path_cost(spur, last[i + 1])
+        if not candidates:
+            break
+        cost, path = heappop(candidates)
+        paths.append((path, cost))
+    return translated(graph, paths)
+
+
+def translated(graph, routes):
+    """
+    Routes with the DIMACS ids of a reordered graph.
+    """
+    original_ids = graph.original_ids
+    if original_ids is None:
+        return routes
+    return [(tuple(original_ids[list(path)].tolist()), cost) for path, cost in routes]
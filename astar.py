@@ -1,44 +1,43 @@
-from graph import Graph, Node
-from queue import PriorityQueue
-from utils import f
+from graph import Graph
+from instrumentation import profiled
+from search import SearchSpace, anytime_search, astar_search
+from spatialIndex import snap
+from utils import geometric_potential
 
 class AStar():
     
-    def __init__(self, h, limit=None):
+    def __init__(self, h, limit=None, graph=None):
         """
         Parameters:
         - h: Heuristic function for AStar.
         - limit: Optional limit for the graph size.
+        - graph: Optional preloaded Graph shared across engines. Loaded once here if not given.
         """
         self.h = h
         self.limit = limit 
+        self.graph = graph if graph is not None else Graph(limit)
+        self.space = SearchSpace(self.graph.num_nodes)
         
-    def query(self, source, destination):
+    @profiled
+    def query(self, source, destination, probe=None, budget=None, weight=1.0, tolerance=1.0):
         """
         Find the optimal path between source and destination nodes using AStar.
 
+        Parameters:
+        - source: Node the search starts from, or a (lat, long) tuple in degrees snapped to the nearest node.
+        - destination: Goal node, or a (lat, long) tuple in degrees.
+        - probe: Optional Probe for detailed stats, hooks and profiling, see instrumentation.
+        - budget: Optional SearchBudget capping the time and expansions of the query, see budget.
+        - weight: Heuristic weight above 1 runs anytime weighted A*, which finds a path within weight times optimal
+          quickly and refines it until it is within tolerance of optimal or the budget runs out.
+        - tolerance: Suboptimality accepted by the anytime search.
+
         Returns:
-        - Node: The destination node, using which we can retrace the path.
+        - SearchResult: Exposes path_cost, num_nodes_processed, stats, bound and solution() to retrace the path.
         """
-        graph = Graph(source, destination, self.limit)
-        start_node = Node(value=source)
-        
-        frontier = PriorityQueue()
-        frontier.put((f(self.h, graph, start_node), start_node))
-
-        reached = {source: start_node}
-        while not frontier.empty():
-            current_node = frontier.get()[1]
-            if graph.is_goal(current_node.value):
-                current_node.num_nodes_processed = len(reached)
-                return current_node
-
-            for child in current_node.expand(graph):
-                child_value = child.value
-                child_path_cost = child.path_cost
-
-                if child_value not in reached or child_path_cost < reached[child_value].path_cost:
-                    reached[child_value] = child
-                    frontier.put((f(self.h, graph, child), child))
-
-        return None
+        source, destination = snap(self.graph, source), snap(self.graph, destination)
+        potential = geometric_potential(self.h, self.graph, destination)
+        if weight > 1:
+            return anytime_search(self.graph, self.space, source, destination, potential, weight, probe, budget,
+                                  tolerance)
+        return astar_search(self.graph, self.space, source, destination, potential, probe, budget)
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import constants
+from astar import AStar
+from binaryGraph import FLAG_REORDERED, load_graph, read_header
+from bidirectionalAstar import BidirectionalAstar
+from contractionHierarchies import ContractionHierarchies
+from dijkstra import one_to_all
+from landmarkAstar import LandmarkAstar
+from spatialIndex import snap
+from utils import haversine, euclidean, landmark_heuristic
+
+ENGINES = ["astar-haversine", "astar-euclidean", "bidirectional", "landmark", "ch"]
+DEFAULT_ENGINES = ["astar-haversine", "astar-euclidean", "bidirectional", "landmark"]
+# Metrics compared against the baseline, a larger value is worse for all of them
+COMPARED_METRICS = ["p50_ms", "p95_ms", "p99_ms", "settled_mean", "nodes_processed_mean", "heap_pushes_mean",
+                    "stale_pops_mean"]
+
+
+def build_engine(name, graph, num_landmarks, cache):
+    """
+    Creates a query engine by name, sharing the loaded graph.
+    """
+    if name == "astar-haversine":
+        return AStar(haversine, graph=graph)
+    if name == "astar-euclidean":
+        return AStar(euclidean, graph=graph)
+    if name == "bidirectional":
+        return BidirectionalAstar(haversine, graph=graph)
+    if name == "landmark":
+        return LandmarkAstar(haversine, landmark_heuristic, num_landmarks, cache=cache, graph=graph)
+    if name == "ch":
+        return ContractionHierarchies(graph=graph, cache=cache)
+    raise ValueError("Unknown engine: {}".format(name))
+
+
+def dimacs_ids(graph):
+    """
+    DIMACS ids of the nodes of graph. Benchmark pairs use them, so a reordered graph is queried
+    on the same nodes as the graph it was built from, and the engines snap them like any caller's.
+    """
+    if graph.original_ids is None:
+        return np.arange(1, graph.num_nodes + 1)
+    return graph.original_ids[1:]
+
+
+def random_pairs(graph, count, rng):
+    """
+    Uniformly random (source, destination) pairs of DIMACS ids.
+    """
+    ids = dimacs_ids(graph)
+    return [(int(ids[rng.randrange(len(ids))]), int(ids[rng.randrange(len(ids))])) for _ in range(count)]
+
+
+def rank_pairs(graph, count, rng):
+    """
+    Query sets bucketed by Dijkstra rank: the rank of destination is the number of nodes a Dijkstra from source
+    settles before it. The rank exponents up to log2(number of nodes) are split in thirds
+    for short, medium and long queries.
+
+    Returns:
+    - Dictionary mapping "short", "medium" and "long" to lists of (source, destination) pairs of DIMACS ids.
+    """
+    ids = dimacs_ids(graph)
+    exponent = int(np.log2(graph.num_nodes))
+    bounds = np.linspace(4, exponent, 4).astype(int)
+    buckets = {"short": [], "medium": [], "long": []}
+    attempts = 0
+    while min(len(pairs) for pairs in buckets.values()) < count and attempts < 10 * count:
+        attempts += 1
+        source = int(ids[rng.randrange(len(ids))])
+        # The sweep runs on node ids, which differ from the DIMACS ids on a reordered graph
+        distances = one_to_all(graph, snap(graph, source))
+        reached = int(np.isfinite(distances).sum())
+        settle_order = np.argsort(distances, kind="stable")
+        if graph.original_ids is not None:
+            settle_order = graph.original_ids[settle_order]
+        for (name, pairs), low, high in zip(buckets.items(), bounds[:-1], bounds[1:]):
+            low, high = 2 ** low, min(2 ** high, reached)
+            if len(pairs) < count and low < high:
+                pairs.append((source, int(settle_order[rng.randrange(low, high)])))
+    return buckets
+
+
+def summarize(latencies, settled, nodes, pushes, stale):
+    latencies = np.array(latencies) * 1000
+    return {
+        "queries": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "queries_per_second": float(1000 * len(latencies) / latencies.sum()) if latencies.sum() else 0.0,
+        "settled_mean": float(np.mean(settled)),
+        "nodes_processed_mean": float(np.mean(nodes)),
+        "heap_pushes_mean": float(np.mean(pushes)),
+        "stale_pops_mean": float(np.mean(stale)),
+    }
+
+
+def run_queries(engine, pairs, warmup, memory_queries):
+    """
+    Times every query with perf_counter after warmup queries. Memory is measured in a separate pass
+    under tracemalloc, which slows down every allocation and would distort the timings.
+    """
+    for source, destination in pairs[:warmup]:
+        engine.query(source, destination)
+
+    latencies = []
+    settled = []
+    nodes = []
+    pushes = []
+    stale = []
+    for source, destination in pairs:
+        start = time.perf_counter()
+        result = engine.query(source, destination)
+        latencies.append(time.perf_counter() - start)
+        settled.append(result.stats.settled if result else 0)
+        nodes.append(result.num_nodes_processed if result else 0)
+        pushes.append(result.stats.pushes if result else 0)
+        stale.append(result.stats.stale_pops if result else 0)
+    summary = summarize(latencies, settled, nodes, pushes, stale)
+
+    tracemalloc.start()
+    for source, destination in pairs[:memory_queries]:
+        engine.query(source, destination)
+    summary["tracemalloc_peak_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return summary
+
+
+def compare(report, baseline, tolerance):
+    """
+    Lists the metrics that got worse than the baseline by more than tolerance.
+    """
+    regressions = []
+    for engine, query_sets in report["engines"].items():
+        for query_set, metrics in query_sets.items():
+            base = baseline.get("engines", {}).get(engine, {}).get(query_set)
+            if not base:
+                continue
+            for metric in COMPARED_METRICS:
+                if metric in base and base[metric] > 0 and metrics[metric] > base[metric] * (1 + tolerance):
+                    regressions.append({"engine": engine, "query_set": query_set, "metric": metric,
+                                        "baseline": base[metric], "value": metrics[metric],
+                                        "change": metrics[metric] / base[metric] - 1})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shortest path engines on seeded query sets.")
+    parser.add_argument("--engines", nargs="+", default=DEFAULT_ENGINES, choices=ENGINES, help="Engines to benchmark.")
+    parser.add_argument("--queries", type=int, default=50, help="Random queries, and queries per Dijkstra rank bucket.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the query sets.")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed queries run before each query set.")
+    parser.add_argument("--memory-queries", type=int, default=5, help="Queries run under tracemalloc per query set.")
+    parser.add_argument("--no-rank", action="store_true", help="Skip the Dijkstra rank query sets.")
+    parser.add_argument("--limit", type=int, default=None, help="Optional limit for the graph size.")
+    parser.add_argument("--graph", default=constants.BINARY_GRAPH, help="Binary graph file, DIMACS files are used if missing.")
+    parser.add_argument("--landmarks", type=int, default=16, help="Number of landmarks for the landmark engine.")
+    parser.add_argument("--cache", action="store_true", help="Reuse cached landmark tables and hierarchy files.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument("--baseline", help="JSON report to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative slowdown before flagging a regression.")
+    args = parser.parse_args()
+
+    if args.limit and os.path.exists(args.graph) and read_header(args.graph)[0] & FLAG_REORDERED:
+        parser.error("{} is reordered and cannot be limited, use --graph with an unreordered file".format(args.graph))
+
+    start = time.perf_counter()
+    graph = load_graph(args.limit, args.graph)
+    report = {"seed": args.seed, "num_nodes": graph.num_nodes, "load_seconds": time.perf_counter() - start,
+              "preprocess_seconds": {}, "engines": {}}
+
+    rng = random.Random(args.seed)
+    query_sets = {"random": random_pairs(graph, args.queries, rng)}
+    if not args.no_rank:
+        query_sets.update(rank_pairs(graph, args.queries, rng))
+
+    for name in args.engines:
+        start = time.perf_counter()
+        engine = build_engine(name, graph, args.landmarks, args.cache)
+        report["preprocess_seconds"][name] = time.perf_counter() - start
+        report["engines"][name] = {query_set: run_queries(engine, pairs, args.warmup, args.memory_queries)
+                                   for query_set, pairs in query_sets.items() if pairs}
+        print("Benchmarked {}".format(name), file=sys.stderr)
+
+    # ru_maxrss is in kilobytes on Linux
+    report["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["regressions"] = compare(report, json.load(file), args.tolerance)
+        for regression in report["regressions"]:
+            print("Regression: {engine} {query_set} {metric} {baseline:.3f} -> {value:.3f} ({change:+.1%})".format(**regression),
+                  file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
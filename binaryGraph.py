@@ -0,0 +1,260 @@
+import argparse
+import os
+import struct
+import zlib
+import numpy as np
+import constants
+from graph import CSRGraph
+from reorder import reorder_graph
+
+# Header layout: magic, version, flags, number of nodes, number of edges, checksum, padded to 64 bytes
+MAGIC = b"ASPGRAPH"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQI")
+HEADER_SIZE = 64
+FLAG_REVERSE = 1
+FLAG_REORDERED = 2
+
+
+def graph_arrays(graph):
+    """
+    Returns the (name, array) pairs of a CSRGraph in the order they are stored on disk.
+    """
+    arrays = [("offsets", graph.offsets), ("targets", graph.targets), ("weights", graph.weights),
+              ("lat", graph.lat), ("long", graph.long)]
+    if graph.reverse_offsets is not None:
+        arrays += [("reverse_offsets", graph.reverse_offsets), ("reverse_targets", graph.reverse_targets),
+                   ("reverse_weights", graph.reverse_weights)]
+    if graph.original_ids is not None:
+        arrays.append(("original_ids", graph.original_ids))
+    return arrays
+
+
+def graph_checksum(graph):
+    """
+    CRC32 over all arrays of a graph. Computed once and cached on the graph,
+    so landmark tables and other derived files can be tied to the exact graph they were built from.
+    """
+    if graph.checksum is None:
+        if not isinstance(graph, CSRGraph):
+            graph.checksum = graph_checksum(CSRGraph.from_graph(graph))
+            return graph.checksum
+        checksum = 0
+        for _, array in graph_arrays(graph):
+            checksum = zlib.crc32(np.ascontiguousarray(array), checksum)
+        graph.checksum = checksum
+    return graph.checksum
+
+
+def array_layout(num_nodes, num_edges, reverse, reordered=False):
+    """
+    Returns (name, dtype, length) for every array stored in a graph file.
+    """
+    layout = [("offsets", np.int64, num_nodes + 2), ("targets", np.int32, num_edges),
+              ("weights", np.int32, num_edges), ("lat", np.int32, num_nodes + 1),
+              ("long", np.int32, num_nodes + 1)]
+    if reverse:
+        layout += [("reverse_offsets", np.int64, num_nodes + 2), ("reverse_targets", np.int32, num_edges),
+                   ("reverse_weights", np.int32, num_edges)]
+    if reordered:
+        layout.append(("original_ids", np.int32, num_nodes + 1))
+    return layout
+
+
+def align(position):
+    # Keep every array 8 byte aligned so the mapped views can be used directly
+    return (position + 7) & ~7
+
+
+def write_arrays(file, arrays):
+    """
+    Writes arrays after a header, each one 8 byte aligned.
+
+    Parameters:
+    - file: File opened for binary writing, positioned after the header.
+    - arrays: List of (array, dtype), a None dtype keeps the dtype of the array.
+    """
+    for array, dtype in arrays:
+        file.write(b"\0" * (align(file.tell()) - file.tell()))
+        np.ascontiguousarray(array, dtype=dtype).tofile(file)
+
+
+def unpack_header(data, header, size, magic, version, kind, file_path):
+    """
+    Validates the magic and version of a file header shared by the binary formats.
+
+    Parameters:
+    - data: Bytes or uint8 array starting with the header.
+    - header: struct.Struct of the header, starting with the magic and the version.
+    - size: Size the header is padded to.
+    - magic, version: Expected magic and version.
+    - kind: Name of the format, for the errors.
+    - file_path: Path of the file, for the errors.
+
+    Returns:
+    - Tuple of the header fields after the magic and the version.
+    """
+    if len(data) < size:
+        raise ValueError("{} is not a {} file".format(file_path, kind))
+    fields = header.unpack_from(bytes(data[:size]))
+    if fields[0] != magic:
+        raise ValueError("{} is not a {} file".format(file_path, kind))
+    if fields[1] != version:
+        raise ValueError("{} has version {}, expected {}".format(file_path, fields[1], version))
+    return fields[2:]
+
+
+def map_arrays(buffer, offset, layout, file_path):
+    """
+    Views of the arrays written by write_arrays, without copying them.
+
+    Parameters:
+    - buffer: uint8 array holding the file, usually a memmap.
+    - offset: Position of the first array, the header size.
+    - layout: List of (dtype, shape) in file order, shape being a length or a tuple.
+    - file_path: Path of the file, for the errors.
+
+    Returns:
+    - List of arrays. A file too short for the layout raises a ValueError.
+    """
+    arrays = []
+    position = offset
+    for dtype, shape in layout:
+        position = align(position)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if position + size > len(buffer):
+            raise ValueError("{} is truncated".format(file_path))
+        arrays.append(buffer[position:position + size].view(dtype).reshape(shape))
+        position += size
+    return arrays
+
+
+def write_graph(graph, file_path):
+    """
+    Writes a CSRGraph to a versioned binary file.
+
+    Parameters:
+    - graph: CSRGraph to be written.
+    - file_path: Path of the output file.
+    """
+    reverse = graph.reverse_offsets is not None
+    reordered = graph.original_ids is not None
+    checksum = graph_checksum(graph)
+    flags = (FLAG_REVERSE if reverse else 0) | (FLAG_REORDERED if reordered else 0)
+    with open(file_path, "wb") as file:
+        header = HEADER.pack(MAGIC, VERSION, flags, graph.num_nodes, graph.num_edges, checksum)
+        file.write(header.ljust(HEADER_SIZE, b"\0"))
+        write_arrays(file, [(getattr(graph, name), dtype)
+                            for name, dtype, _ in array_layout(graph.num_nodes, graph.num_edges, reverse, reordered)])
+
+
+def read_header(file_path):
+    """
+    Reads and validates the header of a binary graph file.
+
+    Returns:
+    - Tuple of (flags, number of nodes, number of edges, checksum).
+    """
+    with open(file_path, "rb") as file:
+        header = file.read(HEADER_SIZE)
+    return unpack_header(header, HEADER, HEADER_SIZE, MAGIC, VERSION, "binary graph", file_path)
+
+
+def read_graph(file_path, limit=None, mmap=True, verify=False):
+    """
+    Opens a binary graph file. With mmap the arrays are views over the mapped file, so opening is O(1)
+    and processes opening the same file share its pages.
+
+    Parameters:
+    - file_path: Path of the binary graph file.
+    - limit: Optional parameter to only keep the subgraph induced by nodes 1..limit, not supported for reordered graphs.
+    - mmap: Map the file instead of reading it into memory.
+    - verify: Recompute the checksum and compare it against the header.
+
+    Returns:
+    - CSRGraph backed by the file contents.
+    """
+    flags, num_nodes, num_edges, checksum = read_header(file_path)
+    reverse = bool(flags & FLAG_REVERSE)
+    reordered = bool(flags & FLAG_REORDERED)
+    if reordered and limit and limit < num_nodes:
+        raise ValueError("{} is reordered, limit the DIMACS graph before reordering instead".format(file_path))
+    if mmap:
+        buffer = np.memmap(file_path, dtype=np.uint8, mode="r")
+    else:
+        buffer = np.fromfile(file_path, dtype=np.uint8)
+
+    layout = array_layout(num_nodes, num_edges, reverse, reordered)
+    views = map_arrays(buffer, HEADER_SIZE, [(dtype, length) for _, dtype, length in layout], file_path)
+    arrays = {name: view for (name, _, _), view in zip(layout, views)}
+
+    graph = CSRGraph(checksum=checksum, **arrays)
+    if verify:
+        graph.checksum = None
+        if graph_checksum(graph) != checksum:
+            raise ValueError("{} failed checksum verification".format(file_path))
+    if limit and limit < num_nodes:
+        graph = induced_subgraph(graph, limit)
+    return graph
+
+
+def induced_subgraph(graph, limit):
+    """
+    Returns the subgraph induced by nodes 1..limit. Per node arrays are views of the original ones,
+    edge arrays are only copied when some edge leaves the node range.
+    """
+    offsets, targets, weights = induced_csr(graph.offsets, graph.targets, graph.weights, limit)
+    reverse = (None, None, None)
+    if graph.reverse_offsets is not None:
+        reverse = induced_csr(graph.reverse_offsets, graph.reverse_targets, graph.reverse_weights, limit)
+    # The checksum is left to graph_checksum, so it matches the same subgraph loaded from the DIMACS files
+    return CSRGraph(offsets, targets, weights, graph.lat[:limit + 1], graph.long[:limit + 1], *reverse, limit=limit)
+
+
+def induced_csr(offsets, targets, weights, limit):
+    offsets = offsets[:limit + 2]
+    end = int(offsets[-1])
+    targets = targets[:end]
+    weights = weights[:end]
+    keep = targets <= limit
+    if keep.all():
+        return offsets, targets, weights
+    kept = np.zeros(end + 1, dtype=np.int64)
+    np.cumsum(keep, out=kept[1:])
+    return kept[offsets], targets[keep], weights[keep]
+
+
+def load_graph(limit=None, file_path=constants.BINARY_GRAPH):
+    """
+    Opens the binary graph file if it was converted already, otherwise parses the DIMACS files.
+    """
+    if os.path.exists(file_path):
+        return read_graph(file_path, limit)
+    return CSRGraph.load(limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the DIMACS graph files into a binary graph file.")
+    parser.add_argument("output", nargs="?", default=constants.BINARY_GRAPH, help="Path of the binary graph file.")
+    parser.add_argument("--no-reverse", action="store_true", help="Do not store the reversed edges.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes parsing the DIMACS files.")
+    parser.add_argument("--reorder", choices=("hilbert", "bfs"), help="Renumber the nodes for locality before writing.")
+    parser.add_argument("--spatial-index", default=constants.SPATIAL_INDEX, help="Path of the spatial index file written alongside.")
+    args = parser.parse_args()
+
+    graph = CSRGraph.load(processes=args.processes)
+    if args.reorder:
+        graph = reorder_graph(graph, args.reorder)
+    if args.no_reverse:
+        graph.reverse_offsets = graph.reverse_targets = graph.reverse_weights = None
+    write_graph(graph, args.output)
+    print("Wrote {} nodes and {} edges to {}".format(graph.num_nodes, graph.num_edges, args.output))
+
+    # Imported here, spatialIndex depends on this module
+    from spatialIndex import SpatialIndex
+    SpatialIndex.build(graph).save(args.spatial_index)
+    print("Wrote the spatial index to {}".format(args.spatial_index))
+
+
+if __name__ == "__main__":
+    main()
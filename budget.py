@@ -0,0 +1,68 @@
+from time import perf_counter
+
+# Expansions between two looks at the clock, reading it costs about as much as an expansion
+CHECK_INTERVAL = 64
+
+
+class SearchBudget:
+
+    def __init__(self, timeout=None, max_expansions=None, check_interval=CHECK_INTERVAL):
+        """
+        Limits on the work of a query, checked cooperatively by the search loops before every expansion.
+        Outdated frontier entries skipped on the way are not charged.
+        A search that runs out returns the best path it found so far with its proven suboptimality bound,
+        or raises a TimeoutError if it has none yet.
+
+        A budget can be reused, the timeout and the expansion count start over with every query.
+
+        Parameters:
+        - timeout: Optional seconds a query may run.
+        - max_expansions: Optional number of nodes a query may expand.
+        - check_interval: Expansions between two looks at the clock.
+        """
+        self.timeout = timeout
+        self.max_expansions = max_expansions
+        self.check_interval = check_interval
+        self.cancelled = False
+        self.deadline = None
+        self.expansions = 0
+        # Why the last query stopped early, None if it ran to the end
+        self.reason = None
+
+    def begin(self):
+        """
+        Starts the clock and the expansion count of a query.
+        """
+        self.expansions = 0
+        self.reason = None
+        self.deadline = None if self.timeout is None else perf_counter() + self.timeout
+
+    def cancel(self):
+        """
+        Stops the queries using this budget at their next expansion, safe to call from another thread.
+        Stays in effect until cancelled is set back to False.
+        """
+        self.cancelled = True
+
+    def exhausted(self):
+        """
+        Counts an expansion.
+
+        Returns:
+        - Whether the query has to stop instead, reason tells why.
+        """
+        self.expansions += 1
+        if self.cancelled:
+            self.reason = "cancelled"
+        elif self.max_expansions is not None and self.expansions > self.max_expansions:
+            self.reason = "expansions"
+        elif (self.deadline is not None and self.expansions % self.check_interval == 0
+              and perf_counter() >= self.deadline):
+            self.reason = "timeout"
+        return self.reason is not None
+
+    def interrupted(self):
+        """
+        Error raised by a search that ran out before finding any path.
+        """
+        return TimeoutError("Search stopped early ({}) before reaching the destination".format(self.reason))
@@ -0,0 +1,242 @@
+from collections import OrderedDict
+from math import inf
+from dijkstra import ShortestPathTree
+from instrumentation import SearchStats
+from spatialIndex import snap
+
+
+class CachedResult:
+
+    def __init__(self, path, path_cost, num_nodes_processed=0):
+        """
+        Query result answered from the cache, exposing the same attributes as the engine results.
+        """
+        self.value = path[-1]
+        self.path = path
+        self.path_cost = path_cost
+        self.num_nodes_processed = num_nodes_processed
+        self.stats = SearchStats(num_nodes_processed)
+
+    def solution(self):
+        return self.path
+
+
+class CachedRouter:
+
+    def __init__(self, engine, max_results=100000, max_tree_nodes=5000000, hot_threshold=2):
+        """
+        Caching layer around a query engine, for traffic where a few sources and destinations come up again and again.
+
+        Exact (source, destination) results are memoized. Once a source (or destination) was seen hot_threshold times,
+        a shortest path tree is grown from it (on the reversed graph for destinations) and later queries
+        are answered from the tree, resuming it when the other end is not settled yet.
+        Both caches are least recently used, trees are bounded by the total number of nodes they hold.
+
+        Parameters:
+        - engine: AStar, BidirectionalAstar, LandmarkAstar or ContractionHierarchies instance.
+        - max_results: Maximum number of memoized results.
+        - max_tree_nodes: Maximum number of nodes held by all cached trees together.
+        - hot_threshold: Number of queries from a source or to a destination before a tree is grown for it.
+        """
+        self.engine = engine
+        self.graph = engine.graph
+        self.reverse_graph = self.graph.reverse()
+        self.max_results = max_results
+        self.max_tree_nodes = max_tree_nodes
+        self.hot_threshold = hot_threshold
+
+        self.results = OrderedDict()
+        # Trees keyed by (root, is reversed)
+        self.trees = OrderedDict()
+        self.tree_nodes = 0
+        # Query counts of recent sources and destinations, bounded like the results
+        self.seen = OrderedDict()
+        # Weight updates: version of the cache and the version in which each arc last got more expensive
+        self.version = 0
+        self.changed = {}
+
+        self.result_hits = 0
+        self.tree_hits = 0
+        self.misses = 0
+        self.result_evictions = 0
+        self.tree_evictions = 0
+        self.invalidations = 0
+
+    def query(self, source, destination, probe=None):
+        """
+        Find the optimal path between source and destination nodes, from the cache where possible.
+        The probe is passed on to the engine, so it only applies to queries that miss the cache.
+
+        Returns:
+        - Result exposing path_cost, num_nodes_processed and solution(), or None if no path is found.
+        """
+        # Snapped first, so coordinates close to the same nodes share cache entries
+        source, destination = snap(self.graph, source), snap(self.graph, destination)
+        key = (source, destination)
+        if key in self.results:
+            result, version = self.results[key]
+            if version == self.version or self.still_valid(result, version):
+                self.results[key] = (result, self.version)
+                self.results.move_to_end(key)
+                self.result_hits += 1
+                return result
+            del self.results[key]
+            self.invalidations += 1
+
+        result = self.from_tree(source, destination)
+        if result is not False:
+            self.tree_hits += 1
+        else:
+            self.misses += 1
+            # The engine snaps node values again, hand it the DIMACS ids
+            result = self.engine.query(self.original_id(source), self.original_id(destination), probe)
+            if result is not None:
+                # Retrace the path now, the engine reuses its labels on the next query
+                result.solution()
+        self.remember(key, result)
+        return result
+
+    def from_tree(self, source, destination):
+        """
+        Answers a query from a cached or newly grown tree.
+
+        Returns:
+        - The result, None if destination can not be reached, or False when no tree applies.
+        """
+        tree = self.tree(source, False)
+        if tree is None:
+            tree = self.tree(destination, True)
+        if tree is None:
+            return False
+
+        size = len(tree)
+        if tree.root == source:
+            cost = tree.settle_until(destination)
+            path = tree.path(destination) if cost < inf else None
+        else:
+            cost = tree.settle_until(source)
+            path = tree.path(source)[::-1] if cost < inf else None
+        self.tree_nodes += len(tree) - size
+        self.evict_trees()
+        if path is None:
+            return None
+        if self.graph.original_ids is not None:
+            path = tuple(self.graph.original_ids[list(path)].tolist())
+        return CachedResult(path, cost, len(tree))
+
+    def original_id(self, node):
+        """
+        DIMACS id of a node of the graph, which differ once the graph is reordered.
+        """
+        original_ids = self.graph.original_ids
+        return node if original_ids is None else int(original_ids[node])
+
+    def tree(self, root, reverse):
+        """
+        Returns the cached tree for root, growing a new one once root turned hot, or None.
+        """
+        key = (root, reverse)
+        if key in self.trees:
+            self.trees.move_to_end(key)
+            return self.trees[key]
+
+        count = self.seen.pop(key, 0) + 1
+        self.seen[key] = count
+        if len(self.seen) > self.max_results:
+            self.seen.popitem(last=False)
+        if count < self.hot_threshold:
+            return None
+
+        tree = ShortestPathTree(self.reverse_graph if reverse else self.graph, root)
+        self.trees[key] = tree
+        self.tree_nodes += len(tree)
+        return tree
+
+    def remember(self, key, result):
+        self.results[key] = (result, self.version)
+        if len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+            self.result_evictions += 1
+
+    def evict_trees(self):
+        # The most recently used tree is kept even if it exceeds the budget on its own
+        while self.tree_nodes > self.max_tree_nodes and len(self.trees) > 1:
+            _, tree = self.trees.popitem(last=False)
+            self.tree_nodes -= len(tree)
+            self.tree_evictions += 1
+
+    def clear(self):
+        """
+        Drops every cached result and tree, the counters are kept.
+        """
+        self.results.clear()
+        self.trees.clear()
+        self.tree_nodes = 0
+        self.changed.clear()
+
+    def invalidate(self, changes, graph):
+        """
+        Drops what a batch of weight changes may have made wrong and moves the cache to the updated graph.
+
+        A cheaper arc can shorten any path, so a decrease clears everything. A more expensive arc only affects
+        the results and trees using it: trees are checked right away, results lazily when they are hit,
+        against the version in which each of their arcs last changed.
+
+        Parameters:
+        - changes: List of (tail, head, old cost, new cost), see traffic.update_weights.
+        - graph: The updated graph the engine now searches.
+        """
+        self.graph = graph
+        self.reverse_graph = graph.reverse()
+        if any(new < old for _, _, old, new in changes):
+            self.invalidations += len(self.results) + len(self.trees)
+            self.clear()
+            return
+
+        self.version += 1
+        for tail, head, _, _ in changes:
+            self.changed[(tail, head)] = self.version
+        for key, tree in list(self.trees.items()):
+            root, reverse = key
+            parent = tree.parent
+            # The tree used the arc if it labeled the head through the tail, or the other way round when reversed
+            if any(parent.get(tail) == head if reverse else parent.get(head) == tail for tail, head, _, _ in changes):
+                del self.trees[key]
+                self.tree_nodes -= len(tree)
+                self.invalidations += 1
+            else:
+                # Arcs the tree did not relax yet are searched with their new cost
+                tree.graph = self.reverse_graph if reverse else self.graph
+
+    def still_valid(self, result, version):
+        """
+        Whether a result cached at version uses no arc that got more expensive since.
+        """
+        if result is None:
+            # More expensive arcs can not connect what was not connected
+            return True
+        path = result.solution()
+        if self.graph.internal_ids is not None:
+            # Paths hold DIMACS ids, changed arcs the ids of the graph
+            path = self.graph.internal_ids[list(path)].tolist()
+        changed = self.changed
+        return all(changed.get(arc, 0) <= version for arc in zip(path, path[1:]))
+
+    def stats(self):
+        """
+        Hit and miss counters along with the current cache sizes, to size the cache in production.
+        """
+        queries = self.result_hits + self.tree_hits + self.misses
+        return {
+            "queries": queries,
+            "result_hits": self.result_hits,
+            "tree_hits": self.tree_hits,
+            "misses": self.misses,
+            "hit_rate": (self.result_hits + self.tree_hits) / queries if queries else 0.0,
+            "result_evictions": self.result_evictions,
+            "tree_evictions": self.tree_evictions,
+            "invalidations": self.invalidations,
+            "results": len(self.results),
+            "trees": len(self.trees),
+            "tree_nodes": self.tree_nodes,
+        }
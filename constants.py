@@ -1,4 +1,8 @@
 RADIUS = 6378
 DISTANCE_MAP = "nyc_distance_dimacs.txt"
 COORDINATE_MAP = "nyc_coordinates_dimacs.txt"
-M = 1e6
\ No newline at end of file
+M = 1e6
+BINARY_GRAPH = "nyc_graph.bin"
+LANDMARK_TABLES = "landmarks.bin"
+HIERARCHY = "hierarchy.bin"
+SPATIAL_INDEX = "spatial_index.bin"
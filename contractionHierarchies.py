@@ -0,0 +1,365 @@
+import os
+import struct
+from heapq import heappush, heappop, heapify
+from itertools import islice
+from math import inf
+from time import perf_counter
+import numpy as np
+import constants
+from binaryGraph import graph_checksum, map_arrays, unpack_header, write_arrays
+from dijkstra import Labels, settle
+from graph import Graph, CSRGraph
+from instrumentation import profiled, search_stats
+from search import SearchSpace, BidirectionalSearchResult, start_bidirectional_search
+from spatialIndex import snap
+
+
+class ContractionHierarchies():
+
+    def __init__(self, limit=None, graph=None, cache=False, witness_limit=500, file_path=constants.HIERARCHY):
+        """
+        Contraction Hierarchies engine. Preprocessing contracts the nodes one by one, adding shortcuts
+        wherever a contraction would lose a shortest path, and queries only ever move up the hierarchy.
+
+        Parameters:
+        - limit: Optional limit for the graph size.
+        - graph: Optional preloaded Graph shared across engines. Loaded once here if not given.
+        - cache: Boolean indicating whether to load the hierarchy from file_path instead of preprocessing.
+          A missing hierarchy, or one built for another graph, is preprocessed and saved again.
+        - witness_limit: Maximum number of nodes settled by a single witness search during preprocessing.
+        - file_path: Path of the hierarchy file.
+        """
+        self.limit = limit
+        self.graph = graph if graph is not None else Graph(limit)
+        self.witness_limit = witness_limit
+        self.file_path = file_path
+
+        loaded = False
+        if cache and os.path.exists(file_path):
+            try:
+                self.load(file_path)
+                loaded = True
+            except ValueError:
+                # Built for another graph, or an older file version
+                pass
+        if not loaded:
+            self.preprocess()
+            self.save(file_path)
+
+        num_nodes = self.graph.num_nodes
+        self.forward_space = SearchSpace(num_nodes)
+        self.backward_space = SearchSpace(num_nodes)
+
+    def preprocess(self):
+        """
+        Contract every node in order of priority. The priority of a node is its edge difference
+        (shortcuts added minus edges removed), plus the number of its neighbors contracted already and
+        its level in the hierarchy, which keeps the contraction spread evenly over the graph.
+        Priorities are updated lazily: a node is only contracted if its recomputed priority
+        is still the smallest one.
+        """
+        graph = self.graph
+        num_nodes = graph.num_nodes
+
+        # Remaining graph, outgoing[u][w] and incoming[w][u] are (cost, middle node) of the edge u -> w
+        # where the middle node of an original edge is 0
+        outgoing = [{} for _ in range(num_nodes + 1)]
+        incoming = [{} for _ in range(num_nodes + 1)]
+        for node in range(1, num_nodes + 1):
+            for neighbor, cost in graph.neighbors(node):
+                if neighbor != node and cost < outgoing[node].get(neighbor, (inf,))[0]:
+                    outgoing[node][neighbor] = (cost, 0)
+                    incoming[neighbor][node] = (cost, 0)
+
+        rank = [0] * (num_nodes + 1)
+        contracted_neighbors = [0] * (num_nodes + 1)
+        level = [0] * (num_nodes + 1)
+        # Final edges as (tail, head, cost, middle), split by whether they lead up or down the hierarchy
+        up_edges = []
+        down_edges = []
+
+        def priority(node):
+            shortcuts = self.shortcuts(node, outgoing, incoming)
+            edge_difference = len(shortcuts) - len(outgoing[node]) - len(incoming[node])
+            return edge_difference + contracted_neighbors[node] + level[node], shortcuts
+
+        queue = [(priority(node)[0], node) for node in range(1, num_nodes + 1)]
+        heapify(queue)
+        next_rank = 1
+        while queue:
+            _, node = heappop(queue)
+            node_priority, shortcuts = priority(node)
+            if queue and node_priority > queue[0][0]:
+                heappush(queue, (node_priority, node))
+                continue
+
+            rank[node] = next_rank
+            next_rank += 1
+            # Edges to the remaining nodes all lead up from this node
+            for neighbor, (cost, middle) in outgoing[node].items():
+                up_edges.append((node, neighbor, cost, middle))
+                del incoming[neighbor][node]
+            for neighbor, (cost, middle) in incoming[node].items():
+                down_edges.append((neighbor, node, cost, middle))
+                del outgoing[neighbor][node]
+            for neighbor in set(outgoing[node]) | set(incoming[node]):
+                contracted_neighbors[neighbor] += 1
+                level[neighbor] = max(level[neighbor], level[node] + 1)
+            outgoing[node] = {}
+            incoming[node] = {}
+
+            for tail, head, cost in shortcuts:
+                if cost < outgoing[tail].get(head, (inf,))[0]:
+                    outgoing[tail][head] = (cost, node)
+                    incoming[head][tail] = (cost, node)
+
+        self.rank = np.array(rank, dtype=np.int32)
+        self.build(up_edges, down_edges)
+
+    def shortcuts(self, node, outgoing, incoming):
+        """
+        Shortcuts needed to contract node: u -> node -> w needs a shortcut u -> w unless a witness search
+        from u, avoiding node, finds a path to w that is no longer.
+
+        Returns:
+        - List of (tail, head, cost) shortcuts.
+        """
+        shortcuts = []
+        for tail, (tail_cost, _) in incoming[node].items():
+            heads = [(head, tail_cost + head_cost) for head, (head_cost, _) in outgoing[node].items() if head != tail]
+            if not heads:
+                continue
+            distances = self.witness_search(tail, node, max(cost for _, cost in heads), outgoing)
+            for head, cost in heads:
+                if distances.get(head, inf) > cost:
+                    shortcuts.append((tail, head, cost))
+        return shortcuts
+
+    def witness_search(self, source, excluded, max_cost, outgoing):
+        """
+        Dijkstra in the remaining graph from source, avoiding the node being contracted.
+        Stops at max_cost or after witness_limit settled nodes, which may only add unneeded shortcuts.
+        """
+        def neighbors(node):
+            return ((neighbor, cost) for neighbor, (cost, _) in outgoing[node].items() if neighbor != excluded)
+
+        distances = Labels({source: 0})
+        for _ in islice(settle(neighbors, [(0, source)], distances, budget=max_cost), self.witness_limit):
+            pass
+        return distances
+
+    def build(self, up_edges, down_edges):
+        """
+        Stores the upward edges of every node in CSR form. The forward search uses edges u -> w with w ranked
+        above u, the backward search uses the down edges u -> w reversed, so they lead up from w to u.
+        """
+        num_nodes = self.graph.num_nodes
+        lat = np.zeros(num_nodes + 1, dtype=np.int32)
+        long = np.zeros(num_nodes + 1, dtype=np.int32)
+
+        up = hierarchy_csr(num_nodes, [(tail, head, cost, middle) for tail, head, cost, middle in up_edges])
+        down = hierarchy_csr(num_nodes, [(head, tail, cost, middle) for tail, head, cost, middle in down_edges])
+        self.up_middle = up[3]
+        self.down_middle = down[3]
+        # Same node ids as the graph, probe hooks translate them through original_ids
+        self.up_graph = CSRGraph(*up[:3], lat, long, original_ids=self.graph.original_ids)
+        self.down_graph = CSRGraph(*down[:3], lat, long, original_ids=self.graph.original_ids)
+        self._bind_views()
+
+    def _bind_views(self):
+        # Python level lookups while unpacking paths are much faster through memoryviews
+        self._rank = memoryview(self.rank)
+        self._up_middle = memoryview(self.up_middle)
+        self._down_middle = memoryview(self.down_middle)
+
+    @profiled
+    def query(self, source, destination, probe=None):
+        """
+        Find the optimal path between source and destination nodes with a bidirectional Dijkstra
+        that only relaxes edges leading up the hierarchy.
+
+        Parameters:
+        - source: Node the search starts from, or a (lat, long) tuple in degrees snapped to the nearest node.
+        - destination: Goal node, or a (lat, long) tuple in degrees.
+        - probe: Optional Probe for detailed stats, hooks and profiling, see instrumentation.
+
+        Returns:
+        - HierarchyResult: Exposes path_cost, num_nodes_processed, stats and solution(), which unpacks the shortcuts.
+        """
+        start_time = perf_counter()
+        source, destination = snap(self.graph, source), snap(self.graph, destination)
+        forward_space = self.forward_space
+        backward_space = self.backward_space
+        # No heuristic and no budget, the upward searches settle only a few hundred nodes
+        forward, backward = start_bidirectional_search(self.up_graph, self.down_graph, forward_space, backward_space,
+                                                       source, destination, None, probe, None)
+        forward_version, up_neighbors, _, forward_frontier, on_settle = forward
+        backward_version, down_neighbors, _, backward_frontier, _ = backward
+
+        best = 0 if source == destination else inf
+        meeting = source
+        num_reached = 2
+        num_stale = 0
+        while True:
+            forward_key = forward_frontier.peek() if forward_frontier else inf
+            backward_key = backward_frontier.peek() if backward_frontier else inf
+            # The upward searches can only stop once both of them passed mu
+            if min(forward_key, backward_key) >= best:
+                break
+            if forward_key <= backward_key:
+                neighbors, space, version, frontier = up_neighbors, forward_space, forward_version, forward_frontier
+                other_space, other_version = backward_space, backward_version
+            else:
+                neighbors, space, version, frontier = down_neighbors, backward_space, backward_version, backward_frontier
+                other_space, other_version = forward_space, forward_version
+
+            distance = space.distance
+            stamp = space.stamp
+            node = frontier.pop()[1]
+            if space.settled[node] == version:
+                num_stale += 1
+                continue
+            space.settled[node] = version
+            if on_settle is not None:
+                on_settle(node, distance[node])
+            node_distance = distance[node]
+            for neighbor, cost in neighbors(node):
+                new_distance = node_distance + cost
+                if stamp[neighbor] != version:
+                    stamp[neighbor] = version
+                    num_reached += 1
+                elif new_distance >= distance[neighbor]:
+                    continue
+                distance[neighbor] = new_distance
+                space.parent[neighbor] = node
+                frontier.push(new_distance, neighbor)
+                if other_space.stamp[neighbor] == other_version and new_distance + other_space.distance[neighbor] < best:
+                    best = new_distance + other_space.distance[neighbor]
+                    meeting = neighbor
+
+        stats = search_stats((forward_frontier, backward_frontier), num_reached, num_stale, start_time, probe)
+        if best == inf:
+            return None
+        return HierarchyResult(self, forward_space, backward_space, source, destination, meeting, best, stats,
+                               self.graph.original_ids)
+
+    def upward_search(self, start, backward=False):
+        """
+        Complete Dijkstra from start over the upward edges, the search space is small in a hierarchy.
+        Used by the bucket based many-to-many computation in distanceMatrix.
+
+        Parameters:
+        - start: Node the search starts from.
+        - backward: Search the reversed down edges, as the backward search of a query does.
+
+        Returns:
+        - List of (node, distance) pairs in settle order. The parents stay in the search space until its next use.
+        """
+        graph = self.down_graph if backward else self.up_graph
+        space = self.backward_space if backward else self.forward_space
+        version = space.reset()
+        distance = Labels({start: 0})
+        parent = {start: 0}
+        result = []
+        for node, node_distance in settle(graph.neighbors, [(0, start)], distance, parent):
+            space.stamp[node] = space.settled[node] = version
+            space.distance[node] = node_distance
+            space.parent[node] = parent[node]
+            result.append((node, node_distance))
+        return result
+
+    def middle(self, tail, head):
+        """
+        Middle node of the hierarchy edge tail -> head, 0 if it is an original edge.
+        """
+        if self._rank[tail] < self._rank[head]:
+            return self._up_middle[self.up_graph.edge_index(tail, head)]
+        return self._down_middle[self.down_graph.edge_index(head, tail)]
+
+    def unpack(self, packed_path):
+        """
+        Replaces every shortcut of a path through the hierarchy by the edges it stands for.
+        """
+        path = [packed_path[0]]
+        for edge in zip(packed_path, packed_path[1:]):
+            stack = [edge]
+            while stack:
+                tail, head = stack.pop()
+                middle = self.middle(tail, head)
+                if middle:
+                    stack.append((middle, head))
+                    stack.append((tail, middle))
+                else:
+                    path.append(head)
+        return tuple(path)
+
+    def save(self, file_path):
+        """
+        Writes the hierarchy to a versioned binary file tied to the graph checksum.
+        """
+        arrays = [self.rank.astype(np.int32),
+                  self.up_graph.offsets, self.up_graph.targets, self.up_graph.weights, self.up_middle,
+                  self.down_graph.offsets, self.down_graph.targets, self.down_graph.weights, self.down_middle]
+        with open(file_path, "wb") as file:
+            header = HIERARCHY_HEADER.pack(HIERARCHY_MAGIC, HIERARCHY_VERSION, self.graph.num_nodes,
+                                           self.up_graph.num_edges, self.down_graph.num_edges, graph_checksum(self.graph))
+            file.write(header.ljust(HIERARCHY_HEADER_SIZE, b"\0"))
+            write_arrays(file, [(array, None) for array in arrays])
+
+    def load(self, file_path):
+        """
+        Maps a hierarchy file written by save. A hierarchy built for another graph raises a ValueError.
+        """
+        buffer = np.memmap(file_path, dtype=np.uint8, mode="r")
+        num_nodes, num_up, num_down, checksum = unpack_header(buffer, HIERARCHY_HEADER, HIERARCHY_HEADER_SIZE,
+                                                              HIERARCHY_MAGIC, HIERARCHY_VERSION, "hierarchy", file_path)
+        if checksum != graph_checksum(self.graph) or num_nodes != self.graph.num_nodes:
+            raise ValueError("{} was computed for a different graph, run the preprocessing again".format(file_path))
+
+        layout = [(np.int32, num_nodes + 1),
+                  (np.int64, num_nodes + 2), (np.int32, num_up), (np.int64, num_up), (np.int32, num_up),
+                  (np.int64, num_nodes + 2), (np.int32, num_down), (np.int64, num_down), (np.int32, num_down)]
+        arrays = map_arrays(buffer, HIERARCHY_HEADER_SIZE, layout, file_path)
+
+        lat = np.zeros(num_nodes + 1, dtype=np.int32)
+        long = np.zeros(num_nodes + 1, dtype=np.int32)
+        self.rank = arrays[0]
+        self.up_graph = CSRGraph(*arrays[1:4], lat, long, original_ids=self.graph.original_ids)
+        self.up_middle = arrays[4]
+        self.down_graph = CSRGraph(*arrays[5:8], lat, long, original_ids=self.graph.original_ids)
+        self.down_middle = arrays[8]
+        self._bind_views()
+
+
+class HierarchyResult(BidirectionalSearchResult):
+
+    def __init__(self, hierarchy, *args):
+        """
+        Result of a ContractionHierarchies query, solution() returns the path with all shortcuts unpacked.
+        """
+        self.hierarchy = hierarchy
+        super().__init__(*args)
+
+    def retrace(self):
+        return self.hierarchy.unpack(super().retrace())
+
+
+# Header layout: magic, version, number of nodes, number of up and down edges, graph checksum, padded to 64 bytes
+HIERARCHY_MAGIC = b"ASPCHIER"
+HIERARCHY_VERSION = 1
+HIERARCHY_HEADER = struct.Struct("<8sIQQQI")
+HIERARCHY_HEADER_SIZE = 64
+
+
+def hierarchy_csr(num_nodes, edges):
+    """
+    Builds CSR arrays from (tail, head, cost, middle) edges.
+
+    Returns:
+    - Tuple of (offsets, targets, weights, middles) arrays.
+    """
+    edges = np.array(edges, dtype=np.int64).reshape(-1, 4)
+    edges = edges[np.argsort(edges[:, 0], kind="stable")]
+    offsets = np.zeros(num_nodes + 2, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 0], minlength=num_nodes + 1), out=offsets[1:])
+    return offsets, edges[:, 1].astype(np.int32), edges[:, 2].copy(), edges[:, 3].astype(np.int32)
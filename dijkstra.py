@@ -0,0 +1,231 @@
+from heapq import heappush, heappop
+from math import inf
+import numpy as np
+from spatialIndex import snap
+
+
+class Labels(dict):
+    """
+    Distance labels of the nodes a search reached, inf for every other node without storing it.
+    """
+
+    def __missing__(self, node):
+        return inf
+
+
+def settle(neighbors, heap, distance, parent=None, budget=inf):
+    """
+    Settle loop shared by the Dijkstra searches: pops the heap in distance order and yields every node
+    it settles, after relaxing the edges of the node into the labels.
+
+    The caller seeds heap with (distance, node) entries and labels the start nodes. An entry is outdated once its
+    node got a smaller label, such entries are skipped when popped. Stopping early, at the budget or by leaving
+    the loop over the generator, keeps the remaining entries on heap, so a new generator over the same heap
+    and labels resumes the search.
+
+    Parameters:
+    - neighbors: Function returning the (neighbor, edge cost) pairs of a node, usually graph.neighbors.
+    - heap: List of (distance, node) entries, a heap.
+    - distance: Labels indexed by node, a list, an array or Labels, giving inf for nodes not reached yet.
+    - parent: Optional labels set to the node every node was last reached from.
+    - budget: Nodes farther than budget are left on heap.
+
+    Yields:
+    - (node, distance) pairs in settle order, so distances never decrease.
+    """
+    while heap:
+        node_distance, node = heap[0]
+        if node_distance > budget:
+            return
+        heappop(heap)
+        if node_distance > distance[node]:
+            # Outdated entry, node was settled with a smaller distance already
+            continue
+        for neighbor, cost in neighbors(node):
+            new_distance = node_distance + cost
+            if new_distance < distance[neighbor]:
+                distance[neighbor] = new_distance
+                if parent is not None:
+                    parent[neighbor] = node
+                # Pushes the stored label, which a float32 array may have rounded
+                heappush(heap, (distance[neighbor], neighbor))
+        yield node, node_distance
+
+
+def one_to_all(graph, source, parents=False):
+    """
+    Plain Dijkstra from source to every vertex of the graph.
+    Run it on graph.reverse() to get the distances from every vertex to source instead.
+
+    Parameters:
+    - graph: Graph or CSRGraph to search.
+    - source: Node the search starts from.
+    - parents: Also return the shortest path tree.
+
+    Returns:
+    - float64 array of distances indexed by node, inf for unreachable nodes.
+      With parents, a tuple of (distances, parent array) where the parent of unreached nodes and source is 0.
+    """
+    num_nodes = graph.num_nodes
+    distances = [inf] * (num_nodes + 1)
+    parent = [0] * (num_nodes + 1)
+    distances[source] = 0
+
+    for _ in settle(graph.neighbors, [(0, source)], distances, parent):
+        pass
+
+    distances = np.array(distances, dtype=np.float64)
+    if parents:
+        return distances, np.array(parent, dtype=np.int64)
+    return distances
+
+
+def one_to_many(graph, space, source, targets):
+    """
+    Dijkstra from source that stops as soon as every target is settled.
+    The labels of the settled nodes are copied into a reusable SearchSpace,
+    so its parents can be used to retrace paths afterwards.
+
+    Parameters:
+    - graph: Graph or CSRGraph to search.
+    - space: SearchSpace sized for the graph, reset by this call.
+    - source: Node the search starts from.
+    - targets: List of target node values.
+
+    Returns:
+    - List with the distance to every target, inf for unreachable ones.
+    """
+    version = space.reset()
+    remaining = set(targets)
+    distance = Labels({source: 0})
+    parent = {source: 0}
+    if remaining:
+        for node, node_distance in settle(graph.neighbors, [(0, source)], distance, parent):
+            space.stamp[node] = space.settled[node] = version
+            space.distance[node] = node_distance
+            space.parent[node] = parent[node]
+            remaining.discard(node)
+            if not remaining:
+                break
+
+    settled = space.settled
+    return [space.distance[target] if settled[target] == version else inf for target in targets]
+
+
+def within_budget(graph, sources, budget=inf, parents=False):
+    """
+    Dijkstra from one or more sources that stops at a cost budget, yielding nodes as they are settled.
+    Labels are kept in dictionaries, so a small budget only costs time and memory for the nodes it reaches.
+    Run it on graph.reverse() to get the nodes that reach the sources within the budget instead.
+
+    Parameters:
+    - graph: Graph or CSRGraph to search.
+    - sources: Node or (lat, long) tuple the search starts from, or a list, array or other iterable of them.
+      A tuple is always read as one (lat, long) point. Every source starts at cost 0,
+      so nodes get the cost from their closest source.
+    - budget: Largest cost to report, inf for every reachable node.
+    - parents: Also yield the node every node was reached from, 0 for sources.
+
+    Yields:
+    - (node, cost) pairs in settle order, so costs never decrease. With parents, (node, cost, parent) triples.
+    """
+    if isinstance(sources, (int, np.integer, tuple)):
+        sources = [sources]
+    original_ids = graph.original_ids
+    distance = Labels()
+    parent = {}
+    heap = []
+    for source in sources:
+        # Array elements are NumPy integers, yield plain ints like for the reached nodes
+        source = int(snap(graph, source))
+        if source not in distance:
+            distance[source] = 0
+            parent[source] = 0
+            heap.append((0, source))
+
+    for node, node_distance in settle(graph.neighbors, heap, distance, parent, budget):
+        if original_ids is None:
+            yield (node, node_distance, parent[node]) if parents else (node, node_distance)
+        else:
+            # Reordered graphs report DIMACS ids, 0 stays 0
+            original = int(original_ids[node])
+            yield (original, node_distance, int(original_ids[parent[node]])) if parents else (original, node_distance)
+
+
+def isochrone(graph, sources, budget=inf, parents=False):
+    """
+    Every node reachable within a cost budget of the sources, as arrays for bulk consumers.
+    See within_budget for the parameters.
+
+    Returns:
+    - Tuple of (int64 array of nodes, float64 array of costs) sorted by cost.
+      With parents, a tuple of (nodes, costs, int64 array of the node every node was reached from).
+    """
+    settled = list(within_budget(graph, sources, budget, parents))
+    columns = list(zip(*settled)) or [()] * (3 if parents else 2)
+    nodes = np.array(columns[0], dtype=np.int64)
+    costs = np.array(columns[1], dtype=np.float64)
+    if parents:
+        return nodes, costs, np.array(columns[2], dtype=np.int64)
+    return nodes, costs
+
+
+class ShortestPathTree:
+
+    def __init__(self, graph, root):
+        """
+        Dijkstra from root that can be paused and resumed. Nodes are only settled on demand,
+        so a tree answers every target it settled already and grows for the ones it did not.
+        Labels are kept in dictionaries, so a tree only costs memory for the nodes it reached.
+
+        Parameters:
+        - graph: Graph or CSRGraph to search, use graph.reverse() for a tree of paths leading to root.
+        - root: Node the tree grows from.
+        """
+        self.graph = graph
+        self.root = root
+        self.distance = Labels({root: 0})
+        self.parent = {root: 0}
+        self.settled = set()
+        self.heap = [(0, root)]
+
+    def settle_until(self, target):
+        """
+        Resumes the search until target is settled.
+
+        Returns:
+        - Distance from root to target, inf if it can not be reached.
+        """
+        settled = self.settled
+        if target not in settled:
+            for node, _ in settle(self.graph.neighbors, self.heap, self.distance, self.parent):
+                settled.add(node)
+                if node == target:
+                    break
+        return self.distance[target] if target in settled else inf
+
+    def settle_within(self, budget):
+        """
+        Resumes the search until every node within budget of root is settled.
+        """
+        self.settled.update(node for node, _ in settle(self.graph.neighbors, self.heap, self.distance, self.parent,
+                                                       budget))
+
+    def path(self, target):
+        """
+        Retraces the tree path from root to a settled target.
+        """
+        path = []
+        node = target
+        while node:
+            path.append(node)
+            node = self.parent[node]
+        path.reverse()
+        return tuple(path)
+
+    @property
+    def complete(self):
+        return not self.heap
+
+    def __len__(self):
+        return len(self.distance)
@@ -0,0 +1,169 @@
+import bz2
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import numpy as np
+
+# Bytes read and parsed at once, large enough for NumPy to parse at full speed and small enough to bound memory
+CHUNK_SIZE = 1 << 26
+COLUMNS = 3
+
+
+def open_dimacs(file_path):
+    """
+    Opens a DIMACS file for binary reading, decompressing .gz and .bz2 files on the fly.
+    """
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    if file_path.endswith(".bz2"):
+        return bz2.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def find_dimacs(file_path):
+    """
+    Returns file_path, or its .gz or .bz2 copy if only a compressed one exists.
+    """
+    for candidate in (file_path, file_path + ".gz", file_path + ".bz2"):
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError("No such DIMACS file: {}".format(file_path))
+
+
+def read_problem(file_path):
+    """
+    Reads the problem line of a DIMACS file, "p sp n m" for distance files and "p aux sp co n" for coordinate files.
+
+    Returns:
+    - Tuple of (number of nodes, number of records the file declares).
+    """
+    with open_dimacs(file_path) as file:
+        for line in file:
+            if line.startswith(b"p"):
+                fields = line.split()
+                try:
+                    if fields[1:2] == [b"sp"] and len(fields) == 4:
+                        return int(fields[2]), int(fields[3])
+                    if fields[1:4] == [b"aux", b"sp", b"co"] and len(fields) == 5:
+                        return int(fields[4]), int(fields[4])
+                except ValueError:
+                    pass
+                raise ValueError("Malformed problem line in {}: {}".format(file_path, line.decode().strip()))
+            if line.strip() and not line.startswith(b"c"):
+                break
+    raise ValueError("Missing problem line in {}".format(file_path))
+
+
+def parse_chunk(chunk, record):
+    """
+    Parses the records of a chunk of whole lines with NumPy, comment, problem and empty lines are skipped.
+
+    Parameters:
+    - chunk: Bytes holding whole lines.
+    - record: Record letter, b"a" for arcs or b"v" for coordinates.
+
+    Returns:
+    - int64 array of shape (number of records, 3).
+    """
+    num_lines = chunk.count(b"\n") + (not chunk.endswith(b"\n"))
+    num_records = chunk.count(b"\n" + record) + chunk.startswith(record)
+    if num_records != num_lines:
+        # Other lines are usually only in the first chunk, filter them in Python so NumPy only sees records
+        chunk = b"\n".join(line for line in chunk.splitlines() if line.startswith(record))
+    if not num_records:
+        return np.empty((0, COLUMNS), dtype=np.int64)
+    try:
+        # loadtxt parses in C once the record letters are blanked out
+        values = np.loadtxt(BytesIO(chunk.replace(record, b" ")), dtype=np.int64, comments=None, ndmin=2)
+    except ValueError:
+        values = None
+    if values is None or values.shape != (num_records, COLUMNS):
+        raise ValueError("Malformed {} records, expected {} values per line".format(record.decode(), COLUMNS))
+    return values
+
+
+def read_records(file_path, record, count=None, processes=1, chunk_size=CHUNK_SIZE):
+    """
+    Parses every record of one kind from a DIMACS file in large chunks.
+
+    Parameters:
+    - file_path: Path to the file, .gz and .bz2 files are decompressed while streaming.
+    - record: Record letter, b"a" for arcs or b"v" for coordinates.
+    - count: Number of records declared by the problem line. The result is preallocated with it
+      and a file holding a different number of records is rejected.
+    - processes: Worker processes parsing byte ranges of the file in parallel, only for uncompressed files.
+    - chunk_size: Bytes per chunk. Parallel ranges are smaller when that leaves a process without work.
+
+    Returns:
+    - int32 array of shape (number of records, 3), in file order.
+    """
+    if processes and processes > 1 and not file_path.endswith((".gz", ".bz2")):
+        size = os.path.getsize(file_path)
+        # At least one range per process, a single 64MB chunk would keep the others idle
+        step = max(min(chunk_size, -(-size // processes)), 1)
+        tasks = [(file_path, record, start, min(start + step, size)) for start in range(0, size, step)]
+        with ProcessPoolExecutor(processes) as pool:
+            return collect(pool.map(_read_range, tasks), count, file_path)
+    return collect(stream_chunks(file_path, record, chunk_size), count, file_path)
+
+
+def stream_chunks(file_path, record, chunk_size):
+    """
+    Parses the file chunk by chunk, carrying the partial last line of a chunk over to the next one.
+    """
+    rest = b""
+    with open_dimacs(file_path) as file:
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b"\n") + 1
+            rest = data[end:]
+            if end:
+                yield parse_chunk(data[:end], record)
+    if rest:
+        yield parse_chunk(rest, record)
+
+
+def _read_range(task):
+    """
+    Parses the lines starting within a byte range, in a worker.
+    """
+    file_path, record, start, end = task
+    with open(file_path, "rb") as file:
+        if start:
+            # Skip the line running into the range, it belongs to the previous one
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        if position >= end:
+            return np.empty((0, COLUMNS), dtype=np.int32)
+        data = file.read(end - position)
+        if not data.endswith(b"\n"):
+            data += file.readline()
+    # Halves what is sent back to the parent, the values fit int32
+    return parse_chunk(data, record).astype(np.int32)
+
+
+def collect(blocks, count, file_path):
+    """
+    Copies parsed blocks into one int32 array, preallocated when the record count is known.
+    """
+    if count is None:
+        blocks = list(blocks)
+        if not blocks:
+            return np.empty((0, COLUMNS), dtype=np.int32)
+        return np.concatenate(blocks).astype(np.int32)
+
+    result = np.empty((count, COLUMNS), dtype=np.int32)
+    filled = 0
+    for block in blocks:
+        if filled + len(block) > count:
+            raise ValueError("{} holds more records than the {} its problem line declares".format(file_path, count))
+        result[filled:filled + len(block)] = block
+        filled += len(block)
+    if filled != count:
+        raise ValueError("{} holds {} records but its problem line declares {}".format(file_path, filled, count))
+    return result
@@ -0,0 +1,130 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import inf
+import numpy as np
+from dijkstra import one_to_many
+from search import SearchSpace
+from spatialIndex import snap
+
+
+def distance_matrix(graph, sources, targets, paths=False, hierarchy=None, processes=1):
+    """
+    Costs of the shortest paths from every source to every target.
+
+    Without a hierarchy every source runs one Dijkstra that stops once all targets are settled.
+    With a ContractionHierarchies engine the bucket method is used instead: one backward upward search
+    per target fills buckets at the nodes it settles, and one forward upward search per source
+    scans the buckets of the nodes it settles.
+
+    Parameters:
+    - graph: Graph or CSRGraph to search.
+    - sources: List of source node values or (lat, long) tuples.
+    - targets: List of target node values or (lat, long) tuples.
+    - paths: Also return the path of every cell.
+    - hierarchy: Optional ContractionHierarchies preprocessed for graph.
+    - processes: Number of worker processes the sources are split over, None uses every core.
+      The graph is inherited by the workers rather than copied where the platform forks.
+
+    Returns:
+    - float64 array of shape (len(sources), len(targets)), inf where a target can not be reached.
+      With paths, a tuple of (matrix, paths) where paths[i][j] is the path tuple or None.
+    """
+    sources = [snap(graph, source) for source in sources]
+    targets = [snap(graph, target) for target in targets]
+    buckets = backward_trees = None
+    if hierarchy is not None:
+        buckets, backward_trees = fill_buckets(hierarchy, targets, paths)
+
+    processes = processes or os.cpu_count()
+    chunks = [sources[i::processes] for i in range(processes)] if processes > 1 else [sources]
+    chunks = [chunk for chunk in chunks if chunk]
+    job = (graph, targets, paths, hierarchy, buckets, backward_trees)
+
+    if len(chunks) > 1:
+        with ProcessPoolExecutor(len(chunks), initializer=_init_worker, initargs=(job,)) as pool:
+            results = list(pool.map(_rows, chunks))
+    else:
+        _init_worker(job)
+        results = [_rows(chunk) for chunk in chunks]
+
+    # Chunks hold every processes-th source, put the rows back in source order
+    matrix = np.full((len(sources), len(targets)), inf)
+    all_paths = [None] * len(sources)
+    for offset, (rows, row_paths) in enumerate(results):
+        matrix[offset::len(chunks)] = rows
+        if paths:
+            all_paths[offset::len(chunks)] = row_paths
+    if paths:
+        if graph.original_ids is not None:
+            original_ids = graph.original_ids
+            all_paths = [[path and tuple(original_ids[list(path)].tolist()) for path in row] for row in all_paths]
+        return matrix, all_paths
+    return matrix
+
+
+def fill_buckets(hierarchy, targets, paths):
+    """
+    Runs the backward upward search of every target. buckets[v] lists (target index, distance from v to target)
+    for every node v settled by those searches.
+
+    Returns:
+    - Tuple of (buckets, backward trees), the trees map node -> parent per target and are only kept for paths.
+    """
+    buckets = {}
+    backward_trees = [] if paths else None
+    for index, target in enumerate(targets):
+        settled = hierarchy.upward_search(target, backward=True)
+        for node, distance in settled:
+            buckets.setdefault(node, []).append((index, distance))
+        if paths:
+            parent = hierarchy.backward_space.parent
+            backward_trees.append({node: parent[node] for node, _ in settled})
+    return buckets, backward_trees
+
+
+_job = None
+
+
+def _init_worker(job):
+    global _job
+    _job = job
+
+
+def _rows(sources):
+    """
+    Computes the matrix rows of a chunk of sources in a worker.
+    """
+    graph, targets, paths, hierarchy, buckets, backward_trees = _job
+    rows = np.full((len(sources), len(targets)), inf)
+    row_paths = []
+    if hierarchy is None:
+        space = SearchSpace(graph.num_nodes)
+        for i, source in enumerate(sources):
+            rows[i] = one_to_many(graph, space, source, targets)
+            if paths:
+                row_paths.append([space.path(target) if rows[i, j] < inf else None for j, target in enumerate(targets)])
+        return rows, row_paths
+
+    for i, source in enumerate(sources):
+        row = rows[i]
+        meeting = [0] * len(targets)
+        for node, distance in hierarchy.upward_search(source):
+            for j, target_distance in buckets.get(node, ()):
+                if distance + target_distance < row[j]:
+                    row[j] = distance + target_distance
+                    meeting[j] = node
+        if paths:
+            row_paths.append([hierarchy_path(hierarchy, node, backward_trees[j]) if row[j] < inf else None
+                              for j, node in enumerate(meeting)])
+    return rows, row_paths
+
+
+def hierarchy_path(hierarchy, meeting, backward_tree):
+    """
+    Joins the forward upward path to the meeting node with the backward tree of the target, then unpacks shortcuts.
+    """
+    forward_path = hierarchy.forward_space.path(meeting)
+    backward_path = [meeting]
+    while backward_tree[backward_path[-1]]:
+        backward_path.append(backward_tree[backward_path[-1]])
+    return hierarchy.unpack(forward_path + tuple(backward_path[1:]))
@@ -0,0 +1,49 @@
+from heapq import heappush, heappop
+
+
+class Frontier:
+
+    def __init__(self):
+        """
+        Priority queue for the search frontier, a plain binary heap without the locking of queue.PriorityQueue.
+        Entries are (priority, insertion counter, item) so ties are broken in insertion order
+        and items themselves are never compared.
+
+        Decrease key is done lazily: pushing an item again leaves the old entry in the heap,
+        the engines skip it when it is popped after the item was settled.
+        """
+        self.heap = []
+        # Number of pushes so far, doubling as the insertion counter of the entries
+        self.pushes = 0
+        # Entries dropped by clear, never popped
+        self.discarded = 0
+
+    def push(self, priority, item):
+        self.pushes += 1
+        heappush(self.heap, (priority, self.pushes, item))
+
+    def pop(self):
+        """
+        Removes and returns the (priority, item) pair with the smallest priority.
+        """
+        priority, _, item = heappop(self.heap)
+        return priority, item
+
+    def clear(self):
+        """
+        Drops every entry, for searches that reorder their frontier.
+        """
+        self.discarded += len(self.heap)
+        self.heap = []
+
+    def peek(self):
+        """
+        Returns the smallest priority without removing its entry.
+        """
+        return self.heap[0][0]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
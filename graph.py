@@ -1,3 +1,6 @@
+import copy
+import numpy as np
+from dimacs import find_dimacs, read_problem, read_records
 from utils import load_file_into_dict
 import constants
 
@@ -21,8 +24,8 @@ class Node:
 
     def expand(self, graph):
   
-        return (self.child_node(graph, neighbor)
-                for neighbor in graph.actions(self.value))
+        return (Node(neighbor, self, self.path_cost + cost)
+                for neighbor, cost in graph.neighbors(self.value))
 
     def child_node(self, graph, neighbor_value):
         
@@ -54,30 +57,40 @@ class Node:
 
 class Graph:
     
-    def __init__(self, source, destination, limit=None):
+    def __init__(self, limit=None):
         """
-        Intialize a Graph object with source, destination, and limit.
-        Load coordinates and edges from data files into dictionaries.
+        Intialize a Graph object with an optional limit.
+        Load coordinates and edges from data files into dictionaries, along with the reversed edges.
+        The graph is loaded once and shared across queries, source and destination are passed per query.
 
         Parameters:
-        - source: Starting node of the graph.
-        - destination: Goal node of the graph.
         - limit: Optional parameter to limit the number of numbers loaded from files.
         """
-        self.source = source
-        self.destination = destination
-        self.coordinates = load_file_into_dict(constants.COORDINATE_MAP, "v", limit)
-        self.distances = load_file_into_dict(constants.DISTANCE_MAP, "a", limit)
+        # Compressed copies of the DIMACS files are picked up like in CSRGraph.load
+        self.coordinates = load_file_into_dict(find_dimacs(constants.COORDINATE_MAP), "v", limit)
+        self.distances = load_file_into_dict(find_dimacs(constants.DISTANCE_MAP), "a", limit)
+        self.reverse_distances = reverse_distances(self.distances)
         self.limit = limit
+        # Highest node id, so per node arrays can be indexed by node value
+        self.num_nodes = max(max(self.coordinates, default=0), max(self.distances, default=0),
+                             max(self.reverse_distances, default=0))
+        self.checksum = None
+        # Node ids are the DIMACS ids, see CSRGraph for reordered graphs
+        self.original_ids = None
+        self.internal_ids = None
+        # Single element holders, so reversed views share the geometry and spatial index built by either of them
+        self._geometry = [None]
+        self._spatial_index = [None]
         
     def actions(self, node_value):
     
-        return list(self.distances[node_value].keys())
+        return list(self.distances.get(node_value, {}).keys())
 
-    
-    def is_goal(self, node_value):
-        
-        return node_value == self.destination
+    def neighbors(self, node_value):
+        """
+        Returns (neighbor, edge cost) pairs of a node, without building an intermediate list.
+        """
+        return self.distances.get(node_value, {}).items()
     
     def path_cost(self, node_value, neighbor_value):
         """
@@ -85,20 +98,312 @@ class Graph:
         """
         return self.distances[node_value][neighbor_value]
     
+    def geometry(self):
+        """
+        Coordinate arrays for the vectorized heuristics, built on first use. See Geometry.
+        """
+        if self._geometry[0] is None:
+            lat = np.zeros(self.num_nodes + 1)
+            long = np.zeros(self.num_nodes + 1)
+            for key, value in self.coordinates.items():
+                lat[key] = value["lat"]
+                long[key] = value["long"]
+            self._geometry[0] = Geometry(lat, long)
+        return self._geometry[0]
+    
     def reverse(self):
         """
-        Creates a reversed graph. Useful for bidirectional algorithms
+        Creates a reversed view of the graph. Useful for bidirectional algorithms.
+        The reversed edges are built once at load time, so this only swaps references.
 
         Returns:
-        - Reversed graph object with source, destination and edges swapped.
-        """
-        r_graph = Graph(self.destination, self.source, self.limit)
-        reversed_distances = {}
-        for key1, inner_dict in self.distances.items():
-            for key2, value in inner_dict.items():
-                if key2 not in reversed_distances:
-                    reversed_distances[key2] = {}
-                reversed_distances[key2][key1] = value
-                    
-        r_graph.distances = reversed_distances
+        - Reversed graph object sharing coordinates with this graph, with edges swapped.
+        """
+        r_graph = copy.copy(self)
+        r_graph.distances = self.reverse_distances
+        r_graph.reverse_distances = self.distances
         return r_graph
+
+
+def reverse_distances(distances):
+    """
+    Builds the reversed edge dictionary, so that reversed[v][u] is the cost of the edge u -> v.
+    """
+    reversed_distances = {}
+    for key1, inner_dict in distances.items():
+        for key2, value in inner_dict.items():
+            reversed_distances.setdefault(key2, {})[key1] = value
+    return reversed_distances
+
+
+class Geometry:
+
+    def __init__(self, lat, long, lat_radians=None, long_radians=None, cos_lat=None):
+        """
+        Float coordinate arrays indexed by node value, precomputed once per graph so that heuristics
+        only compute the terms depending on the destination once per query.
+
+        Parameters:
+        - lat, long: Fixed point coordinates, as stored in the DIMACS files.
+        - lat_radians, long_radians, cos_lat: Optional float64 arrays computed already, such as the ones
+          a server shares with its workers. Computed from lat and long if not given.
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.long = np.asarray(long, dtype=np.float64)
+        self.lat_radians = np.radians(self.lat / constants.M) if lat_radians is None else lat_radians
+        self.long_radians = np.radians(self.long / constants.M) if long_radians is None else long_radians
+        self.cos_lat = np.cos(self.lat_radians) if cos_lat is None else cos_lat
+
+
+class CoordinateView:
+
+    def __init__(self, lat, long):
+        """
+        Read only, dictionary like view over the coordinate arrays of a CSRGraph.
+        Lets the heuristics in utils keep using graph.coordinates[node]["lat"] on either backend.
+        """
+        self.lat = memoryview(lat)
+        self.long = memoryview(long)
+
+    def __getitem__(self, node_value):
+        return {"lat": self.lat[node_value], "long": self.long[node_value]}
+
+    def __contains__(self, node_value):
+        return 0 < node_value < len(self.lat)
+
+    def __len__(self):
+        return len(self.lat) - 1
+
+
+class CSRGraph:
+
+    def __init__(self, offsets, targets, weights, lat, long,
+                 reverse_offsets=None, reverse_targets=None, reverse_weights=None, limit=None, checksum=None,
+                 original_ids=None):
+        """
+        Array backed graph in compressed sparse row form.
+        The edges of node v are targets[offsets[v]:offsets[v + 1]] with the matching weights.
+        Node ids are the DIMACS ids, so index 0 of every per node array is unused.
+
+        Parameters:
+        - offsets: int64 array of n + 2 edge offsets.
+        - targets: int32 array of edge heads.
+        - weights: int32 array of edge costs.
+        - lat, long: int32 arrays of fixed point coordinates, as stored in the DIMACS files.
+        - reverse_offsets, reverse_targets, reverse_weights: Optional reversed edges in the same form.
+        - limit: The limit the graph was loaded with, if any.
+        - checksum: Checksum of the graph arrays, when known. See binaryGraph.graph_checksum.
+        - original_ids: Optional int32 array mapping node ids to the DIMACS ids, for graphs renumbered by reorder.
+          Engines translate query endpoints and result paths, callers only ever see the DIMACS ids.
+        """
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.lat = lat
+        self.long = long
+        self.reverse_offsets = reverse_offsets
+        self.reverse_targets = reverse_targets
+        self.reverse_weights = reverse_weights
+        self.coordinates = CoordinateView(lat, long)
+        self.limit = limit
+        self.checksum = checksum
+        self.original_ids = original_ids
+        self.internal_ids = None
+        if original_ids is not None:
+            self.internal_ids = np.zeros(int(original_ids.max()) + 1, dtype=np.int32)
+            self.internal_ids[original_ids] = np.arange(len(original_ids), dtype=np.int32)
+        # Single element holders, so reversed views share the geometry and spatial index built by either of them
+        self._geometry = [None]
+        self._spatial_index = [None]
+        self._bind_views()
+
+    def _bind_views(self):
+        # Memoryviews slice and convert to lists noticeably faster than numpy arrays,
+        # which matters since neighbors is called once per expanded node
+        self._offsets = memoryview(self.offsets)
+        self._targets = memoryview(self.targets)
+        self._weights = memoryview(self.weights)
+
+    @classmethod
+    def load(cls, limit=None, processes=1, distance_path=constants.DISTANCE_MAP, coordinate_path=constants.COORDINATE_MAP):
+        """
+        Parse the DIMACS data files straight into the forward and reversed CSR arrays, without building dictionaries.
+        Compressed .gz or .bz2 copies of the files are read when the plain files are missing.
+
+        Parameters:
+        - limit: Optional parameter to limit the number of numbers loaded from files.
+        - processes: Worker processes parsing uncompressed files in parallel.
+        - distance_path, coordinate_path: Paths of the DIMACS files.
+        """
+        distance_path = find_dimacs(distance_path)
+        coordinate_path = find_dimacs(coordinate_path)
+        num_nodes, num_arcs = read_problem(distance_path)
+        _, num_coordinates = read_problem(coordinate_path)
+        arcs = read_records(distance_path, b"a", num_arcs, processes)
+        coordinates = read_records(coordinate_path, b"v", num_coordinates, processes)
+        if arcs.size and (arcs[:, :2].min() < 1 or arcs[:, :2].max() > num_nodes):
+            raise ValueError("{} has arcs between nodes outside 1..{}".format(distance_path, num_nodes))
+        if coordinates.size and (coordinates[:, 0].min() < 1 or coordinates[:, 0].max() > num_nodes):
+            raise ValueError("{} has coordinates of nodes outside 1..{}".format(coordinate_path, num_nodes))
+
+        if limit:
+            arcs = arcs[(arcs[:, 0] <= limit) & (arcs[:, 1] <= limit)]
+            coordinates = coordinates[coordinates[:, 0] <= limit]
+            num_nodes = limit
+        sources, targets, weights = unique_edges(num_nodes, arcs[:, 0], arcs[:, 1], arcs[:, 2])
+
+        lat = np.zeros(num_nodes + 1, dtype=np.int32)
+        long = np.zeros(num_nodes + 1, dtype=np.int32)
+        lat[coordinates[:, 0]] = coordinates[:, 1]
+        long[coordinates[:, 0]] = coordinates[:, 2]
+
+        offsets, csr_targets, csr_weights = build_csr(num_nodes, sources, targets, weights)
+        reverse_offsets, reverse_targets, reverse_weights = reverse_csr(num_nodes, offsets, csr_targets, csr_weights)
+        return cls(offsets, csr_targets, csr_weights, lat, long,
+                   reverse_offsets, reverse_targets, reverse_weights, limit)
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Build a CSRGraph from a dictionary backed Graph.
+        """
+        coordinates = graph.coordinates
+        distances = graph.distances
+        num_nodes = graph.num_nodes
+
+        num_edges = sum(len(inner) for inner in distances.values())
+        sources = np.empty(num_edges, dtype=np.int32)
+        targets = np.empty(num_edges, dtype=np.int32)
+        weights = np.empty(num_edges, dtype=np.int32)
+        i = 0
+        for source, inner in distances.items():
+            j = i + len(inner)
+            sources[i:j] = source
+            targets[i:j] = list(inner.keys())
+            weights[i:j] = list(inner.values())
+            i = j
+
+        lat = np.zeros(num_nodes + 1, dtype=np.int32)
+        long = np.zeros(num_nodes + 1, dtype=np.int32)
+        for key, value in coordinates.items():
+            lat[key] = value["lat"]
+            long[key] = value["long"]
+
+        offsets, csr_targets, csr_weights = build_csr(num_nodes, sources, targets, weights)
+        reverse_offsets, reverse_targets, reverse_weights = reverse_csr(num_nodes, offsets, csr_targets, csr_weights)
+        return cls(offsets, csr_targets, csr_weights, lat, long,
+                   reverse_offsets, reverse_targets, reverse_weights, graph.limit)
+
+    @property
+    def num_nodes(self):
+        return len(self.offsets) - 2
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    @property
+    def nbytes(self):
+        """
+        Total size in bytes of the arrays backing the graph.
+        """
+        arrays = (self.offsets, self.targets, self.weights, self.lat, self.long,
+                  self.reverse_offsets, self.reverse_targets, self.reverse_weights)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def geometry(self):
+        """
+        Coordinate arrays for the vectorized heuristics, built on first use. See Geometry.
+        """
+        if self._geometry[0] is None:
+            self._geometry[0] = Geometry(self.lat, self.long)
+        return self._geometry[0]
+
+    def actions(self, node_value):
+
+        return self._targets[self._offsets[node_value]:self._offsets[node_value + 1]].tolist()
+
+    def neighbors(self, node_value):
+        """
+        Returns (neighbor, edge cost) pairs of a node, straight from the CSR slices.
+        """
+        start = self._offsets[node_value]
+        end = self._offsets[node_value + 1]
+        return zip(self._targets[start:end].tolist(), self._weights[start:end].tolist())
+
+    def path_cost(self, node_value, neighbor_value):
+        """
+        Returns the edge cost from a node to its neighbor.
+        """
+        return self._weights[self.edge_index(node_value, neighbor_value)]
+
+    def edge_index(self, node_value, neighbor_value):
+        """
+        Returns the position of the edge from a node to its neighbor in the targets and weights arrays.
+        """
+        start = self._offsets[node_value]
+        end = self._offsets[node_value + 1]
+        try:
+            return start + self._targets[start:end].tolist().index(neighbor_value)
+        except ValueError:
+            raise KeyError((node_value, neighbor_value)) from None
+
+    def reverse(self):
+        """
+        Creates a reversed view of the graph. Useful for bidirectional algorithms.
+
+        Returns:
+        - Reversed graph object sharing all arrays with this graph, with edges swapped.
+        """
+        if self.reverse_offsets is None:
+            raise ValueError("graph was built without reversed edges")
+        r_graph = copy.copy(self)
+        r_graph.offsets, r_graph.reverse_offsets = self.reverse_offsets, self.offsets
+        r_graph.targets, r_graph.reverse_targets = self.reverse_targets, self.targets
+        r_graph.weights, r_graph.reverse_weights = self.reverse_weights, self.weights
+        r_graph._bind_views()
+        return r_graph
+
+
+def unique_edges(num_nodes, sources, targets, weights):
+    """
+    Drops repeated edges the way the dictionary backed Graph does: an edge keeps the position of its first
+    occurrence and the cost of its last one.
+
+    Returns:
+    - Tuple of (sources, targets, weights) arrays.
+    """
+    keys = sources.astype(np.int64) * (num_nodes + 1) + targets
+    unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    if len(unique) == len(keys):
+        return sources, targets, weights
+    last = np.zeros(len(unique), dtype=np.int64)
+    np.maximum.at(last, inverse, np.arange(len(keys)))
+    first.sort()
+    return sources[first], targets[first], weights[last[inverse[first]]]
+
+
+def build_csr(num_nodes, sources, targets, weights):
+    """
+    Sorts an edge list by source and builds the CSR offsets for nodes 0..num_nodes.
+
+    Returns:
+    - Tuple of (offsets, targets, weights) arrays.
+    """
+    order = np.argsort(sources, kind="stable")
+    counts = np.bincount(sources, minlength=num_nodes + 1)
+    offsets = np.zeros(num_nodes + 2, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, np.ascontiguousarray(targets[order], dtype=np.int32), np.ascontiguousarray(weights[order], dtype=np.int32)
+
+
+def reverse_csr(num_nodes, offsets, targets, weights):
+    """
+    Builds the CSR arrays of the reversed graph from the forward ones. Every row lists its tails in increasing
+    order, so graphs with the same arcs get the same reverse arrays whichever order the arcs came in.
+
+    Returns:
+    - Tuple of (offsets, targets, weights) arrays.
+    """
+    sources = np.repeat(np.arange(num_nodes + 1, dtype=np.int32), np.diff(offsets))
+    return build_csr(num_nodes, targets, sources, weights)
@@ -0,0 +1,201 @@
+import cProfile
+import pstats
+import signal
+from collections import Counter
+from functools import wraps
+from time import perf_counter
+from frontier import Frontier
+
+
+class SearchStats:
+
+    def __init__(self, reached=0, pushes=0, pops=0, stale_pops=0, wall_seconds=0.0):
+        """
+        Counters of a single query, attached to every result as result.stats.
+
+        The counters below are always filled in, they are derived from counts the search keeps anyway.
+        relaxed, peak_frontier, heuristic_seconds and profile stay None unless the query ran with a Probe.
+
+        Parameters:
+        - reached: Nodes that got a label, num_nodes_processed of the result.
+        - pushes: Entries pushed on the frontiers.
+        - pops: Entries popped from the frontiers.
+        - stale_pops: Popped entries of nodes that were settled already.
+        - wall_seconds: Wall time of the search.
+        """
+        self.reached = reached
+        self.pushes = pushes
+        self.pops = pops
+        self.stale_pops = stale_pops
+        self.settled = pops - stale_pops
+        self.wall_seconds = wall_seconds
+        self.relaxed = None
+        self.peak_frontier = None
+        self.heuristic_seconds = None
+        self.profile = None
+
+    def as_dict(self):
+        """
+        The counters as a dictionary, without the profile.
+        """
+        return {name: value for name, value in vars(self).items() if name != "profile"}
+
+    def __repr__(self):
+        return "SearchStats({})".format(", ".join("{}={}".format(name, value) for name, value in self.as_dict().items()))
+
+
+def search_stats(frontiers, reached, stale_pops, start, probe=None):
+    """
+    Builds the stats of a finished search from its frontiers and counters, completed by the probe if any.
+    """
+    pushes = sum(frontier.pushes for frontier in frontiers)
+    pops = pushes - sum(len(frontier) + frontier.discarded for frontier in frontiers)
+    stats = SearchStats(reached, pushes, pops, stale_pops, perf_counter() - start)
+    if probe is not None:
+        probe.finish(stats, frontiers)
+    return stats
+
+
+class PeakFrontier(Frontier):
+
+    def __init__(self):
+        """
+        Frontier that also tracks its largest size, only used for probed queries.
+        """
+        super().__init__()
+        self.peak = 0
+
+    def push(self, priority, item):
+        super().push(priority, item)
+        if len(self.heap) > self.peak:
+            self.peak = len(self.heap)
+
+
+class Probe:
+
+    def __init__(self, on_settle=None, on_relax=None, profile=None, sample_interval=0.001):
+        """
+        Opt in instrumentation passed to the query of an engine. Without a probe the searches only pay
+        for a couple of counters, with one they count relaxed edges, track the peak frontier size,
+        time the heuristic and call the hooks.
+
+        Parameters:
+        - on_settle: Optional function called with (node, distance) for every settled node.
+        - on_relax: Optional function called with (node, neighbor, cost) for every scanned edge.
+          Both hooks get the DIMACS ids of a reordered graph, like the results.
+        - profile: None, "cprofile" for a deterministic profile in stats.profile as pstats.Stats,
+          or "sampling" for a Counter of (file, line, function) samples of the running frame.
+          Sampling uses a profiling timer signal, so it only works in the main thread, and queries
+          shorter than the timer resolution of the system may not get any sample.
+        - sample_interval: Seconds of CPU time between samples.
+
+        The probe can be reused, stats holds the stats of the latest query, also when no path was found.
+        """
+        if profile not in (None, "cprofile", "sampling"):
+            raise ValueError("Unknown profile mode: {}".format(profile))
+        self.on_settle = on_settle
+        self.on_relax = on_relax
+        self.profile = profile
+        self.sample_interval = sample_interval
+        self.stats = None
+        self.relaxed = 0
+        self.heuristic_seconds = 0.0
+
+    def begin(self):
+        self.relaxed = 0
+        self.heuristic_seconds = 0.0
+
+    def neighbors(self, neighbors, original_ids=None):
+        """
+        Wraps the neighbors function of a graph to count the scanned edges and call on_relax.
+        """
+        on_relax = self.on_relax
+        if on_relax is not None and original_ids is not None:
+            on_relax = translated_hook(self.on_relax, original_ids, 2)
+
+        def probed_neighbors(node):
+            edges = list(neighbors(node))
+            self.relaxed += len(edges)
+            if on_relax is not None:
+                for neighbor, cost in edges:
+                    on_relax(node, neighbor, cost)
+            return edges
+
+        return probed_neighbors
+
+    def settle_hook(self, original_ids=None):
+        """
+        on_settle, taking the node ids of the graph searched.
+        """
+        if self.on_settle is None or original_ids is None:
+            return self.on_settle
+        return translated_hook(self.on_settle, original_ids, 1)
+
+    def potential(self, potential):
+        """
+        Wraps a potential function to time the heuristic evaluations.
+        """
+        def probed_potential(nodes):
+            start = perf_counter()
+            values = potential(nodes)
+            self.heuristic_seconds += perf_counter() - start
+            return values
+
+        return probed_potential
+
+    def finish(self, stats, frontiers):
+        stats.relaxed = self.relaxed
+        stats.peak_frontier = sum(getattr(frontier, "peak", 0) for frontier in frontiers)
+        stats.heuristic_seconds = self.heuristic_seconds
+        self.stats = stats
+
+    def run(self, query, *args, **kwargs):
+        """
+        Runs an engine query under the profiler of this probe.
+        """
+        self.stats = None
+        if self.profile == "cprofile":
+            profiler = cProfile.Profile()
+            result = profiler.runcall(query, *args, **kwargs)
+            profile = pstats.Stats(profiler)
+        else:
+            profile = Counter()
+
+            def sample(signum, frame):
+                profile[(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)] += 1
+
+            previous = signal.signal(signal.SIGPROF, sample)
+            signal.setitimer(signal.ITIMER_PROF, self.sample_interval, self.sample_interval)
+            try:
+                result = query(*args, **kwargs)
+            finally:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+                signal.signal(signal.SIGPROF, previous)
+        if self.stats is not None:
+            self.stats.profile = profile
+        return result
+
+
+def translated_hook(hook, original_ids, num_nodes):
+    """
+    Wraps a hook whose first num_nodes arguments are nodes, so it gets the DIMACS ids of a reordered graph.
+    """
+    def translated(*args):
+        return hook(*(int(original_ids[node]) for node in args[:num_nodes]), *args[num_nodes:])
+
+    return translated
+
+
+def profiled(query):
+    """
+    Decorator for the query method of an engine, running the query under the profiler of its probe if it has one.
+    """
+    @wraps(query)
+    def wrapper(engine, *args, **kwargs):
+        # query(source, destination, probe=None, ...), the probe may come positionally or by name
+        probe = args[2] if len(args) > 2 else kwargs.get("probe")
+        if probe is None or probe.profile is None:
+            return query(engine, *args, **kwargs)
+        return probe.run(query, engine, *args, **kwargs)
+
+    return wrapper
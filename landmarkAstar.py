@@ -1,14 +1,24 @@
+import os
 import random
-import pickle 
-from astar import AStar
-from graph import Node, Graph
-from queue import PriorityQueue
-from utils import f2, haversine
+import struct
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import constants
+from binaryGraph import graph_checksum, map_arrays, unpack_header, write_arrays
+from dijkstra import one_to_all
+from graph import Graph
+from instrumentation import profiled
+from search import SearchSpace, anytime_search, astar_search
+from spatialIndex import snap
+from utils import landmark_potential, best_landmarks
 
 
 class LandmarkAstar():
 
-    def __init__(self, h1, h2, num_landmarks=10, limit=None, cache=False):
+    def __init__(self, h1, h2, num_landmarks=10, limit=None, cache=False, graph=None,
+                 selection="avoid", processes=None, seed=None, active_landmarks=None,
+                 file_path=constants.LANDMARK_TABLES, tables=None):
         """
         Initialize the LandmarkAstar object with  heuristic functions, number of landmarks, and a limit.
 
@@ -17,98 +27,358 @@ class LandmarkAstar():
         - h2: Landmark AStar heuristic function.
         - num_landmarks: Number of landmarks to be generated.
         - limit: Optional limit for the graph size.
-        - cache: Boolean indicating whether to do the preprocessing or use old data.
+        - cache: Boolean indicating whether to use the tables saved at file_path, preprocessing runs anyway
+          and rewrites them if they are missing or were computed for another graph or number of landmarks.
+        - graph: Optional preloaded Graph shared across engines. Loaded once here if not given.
+        - selection: Landmark selection method, one of "avoid", "farthest" or "random".
+        - processes: Number of worker processes for the Dijkstra sweeps, None uses every core.
+        - seed: Optional seed for the random choices made during landmark selection.
+        - active_landmarks: Optional number of landmarks to use per query, the ones giving
+          the best bound between source and destination are picked.
+        - file_path: Path of the landmark tables file.
+        - tables: Optional LandmarkTables computed for graph already, used as they are.
         """
         self.h1 = h1
         self.h2 = h2
         self.limit = limit
+        self.graph = graph if graph is not None else Graph(limit)
+        self.space = SearchSpace(self.graph.num_nodes)
         self.num_landmarks = num_landmarks
+        self.selection = selection
+        self.processes = processes
+        self.seed = seed
+        self.active_landmarks = active_landmarks
+        self.file_path = file_path
         
-        if cache:
-            # Load distances from landmarks to all vertices dict and
-            # distances from all vertices to landmarks dict from a cached file
-            with open('landmarks.pkl', 'rb') as pickle_file:
-                dict_list = pickle.load(pickle_file)
-            
-            self.landmarks = dict_list[0]
-            self.landmark_dict = dict_list[1]
-            self.vertex_dict = dict_list[2]
+        if tables is not None:
+            self.tables = tables
+            self.landmarks = tables.landmarks.tolist()
         else:
-            # If caching is not enabled, generate the data
-            self.preprocess(self.num_landmarks)
+            # Load distances from landmarks to all vertices and from all vertices to landmarks
+            # from a cached file, unless it was built for another graph or another number of landmarks
+            self.tables = None
+            if cache and os.path.exists(file_path):
+                try:
+                    self.tables = LandmarkTables.load(file_path, self.graph)
+                except ValueError:
+                    pass
+            if self.tables is not None and len(self.tables.landmarks) == num_landmarks:
+                self.landmarks = self.tables.landmarks.tolist()
+            else:
+                # If caching is not enabled or the cache is missing or stale, generate the data
+                self.preprocess(self.num_landmarks)
     
         
     def preprocess(self, num_landmarks):
         """
-        Generate landmarks and calculate distances between landmarks and vertices.
-
+        Select landmarks and calculate distances between landmarks and vertices.
+        Each landmark needs one Dijkstra sweep on the graph and one on the reversed graph. The selection runs
+        some of them already, the rest are spread over a process pool.
         """
-        # Generate random landmarks
-        landmarks = []
-        for _ in range(num_landmarks):
-            landmarks.append(random.randrange(1, self.limit + 1))
-        
-        
-        astar = AStar(haversine, self.limit)
-        
-        landmark_dict = {}
-        vertex_dict = {}
-        
-        for landmark in landmarks:
-            landmark_dict[landmark] = {}
-            for vertex in range(1, self.limit + 1):
-                # Query AStar for distance from landmark to vertex
-                d = astar.query(landmark, vertex)
-                if d:
-                    landmark_dict[landmark][vertex] = d.path_cost 
-        
-        for vertex in range(1, self.limit + 1):
-            vertex_dict[vertex] = {}
-            for landmark in landmarks:
-                # Query AStar for distance from vertex to landmark
-                d = astar.query(vertex, landmark)
-                if d:
-                    vertex_dict[vertex][landmark] = d.path_cost
-        
-        self.landmark_dict = landmark_dict
-        self.vertex_dict = vertex_dict
+        # Sweeps run while selecting are reused, only the missing ones go to the pool
+        sweeps = {}
+        landmarks = select_landmarks(self.graph, num_landmarks, self.selection, self.seed, sweeps, self.processes)
+        if len(landmarks) < num_landmarks:
+            warnings.warn("Only found {} of {} landmarks with {} selection".format(
+                len(landmarks), num_landmarks, self.selection))
+        forward, backward = landmark_tables(self.graph, landmarks, self.processes, sweeps)
+
+        dtype = table_dtype(forward, backward)
+        self.tables = LandmarkTables(np.array(landmarks, dtype=np.int64), forward.astype(dtype),
+                                     backward.astype(dtype), graph_checksum(self.graph))
         self.landmarks = landmarks
-        
-        dict_list = [landmarks, landmark_dict, vertex_dict]
-        
+
         # Dump the data into a file for future use
-        with open('landmarks.pkl', 'wb') as pickle_file:
-            pickle.dump(dict_list, pickle_file)
+        self.tables.save(self.file_path)
 
-    def query(self, source, destination):
+    @profiled
+    def query(self, source, destination, probe=None, budget=None, weight=1.0, tolerance=1.0):
         """
         Find the optimal path between source and destination nodes using landmark heuristics.
 
+        Parameters:
+        - source: Node the search starts from, or a (lat, long) tuple in degrees snapped to the nearest node.
+        - destination: Goal node, or a (lat, long) tuple in degrees.
+        - probe: Optional Probe for detailed stats, hooks and profiling, see instrumentation.
+        - budget: Optional SearchBudget capping the time and expansions of the query, see budget.
+        - weight: Heuristic weight above 1 runs anytime weighted A*, which finds a path within weight times optimal
+          quickly and refines it until it is within tolerance of optimal or the budget runs out.
+        - tolerance: Suboptimality accepted by the anytime search.
+
         Returns:
-        - Node: The final node in the optimal path.
+        - SearchResult: Exposes path_cost, num_nodes_processed, stats, bound and solution() to retrace the path.
         """
-        partial_graph = Graph(source, destination, self.limit)
-        start_node = Node(value=source)
-        frontier = PriorityQueue()
-        # Use landmark heuristics f2 and h2
-        frontier.put((f2(self.h2, self.landmarks, self.landmark_dict, self.vertex_dict, start_node, destination), start_node))
+        source, destination = snap(self.graph, source), snap(self.graph, destination)
+        active = None
+        if self.active_landmarks:
+            active = best_landmarks(self.tables, source, destination, self.active_landmarks)
+        # Use landmark heuristic h2
+        potential = landmark_potential(self.h2, self.tables, destination, active)
+        if weight > 1:
+            return anytime_search(self.graph, self.space, source, destination, potential, weight, probe, budget,
+                                  tolerance)
+        return astar_search(self.graph, self.space, source, destination, potential, probe, budget)
 
-        reached = {source: start_node}
-        while not frontier.empty():
-            current_node = frontier.get()[1]
-            if partial_graph.is_goal(current_node.value):
-                return current_node
 
-            for child in current_node.expand(partial_graph):
-                child_value = child.value
-                child_path_cost = child.path_cost
+# Header layout: magic, version, number of landmarks, number of nodes, graph checksum,
+# bytes per table entry, padded to 64 bytes
+LANDMARK_MAGIC = b"ASPLANDM"
+LANDMARK_VERSION = 2
+LANDMARK_HEADER = struct.Struct("<8sIIQII")
+LANDMARK_HEADER_SIZE = 64
+# float32 holds every integer up to 2^24 exactly. Beyond that a rounded table entry could make
+# the difference bounds of the ALT heuristic overestimate, so larger distances are kept in float64
+FLOAT32_EXACT = 1 << 24
 
-                if child_value not in reached or child_path_cost < reached[child_value].path_cost:
-                    reached[child_value] = child
-                    frontier.put((f2(self.h2, self.landmarks, self.landmark_dict, self.vertex_dict, child, destination), child))
-        return None
 
+def table_dtype(*tables):
+    """
+    float32 when every finite distance of the tables is an exact float32, float64 otherwise.
+    """
+    largest = max((np.max(table, initial=0, where=np.isfinite(table)) for table in tables), default=0)
+    return np.float32 if largest <= FLOAT32_EXACT else np.float64
 
-        
 
+class LandmarkTables:
+
+    def __init__(self, landmarks, forward, backward, checksum, graph=None):
+        """
+        Dense landmark distance tables for the ALT heuristic.
+
+        Parameters:
+        - landmarks: int64 array of the k landmark node values.
+        - forward: float32 array of shape (k, number of nodes + 1), forward[i, v] is the distance from landmark i to v.
+          float64 when some distance is too large for float32 to hold exactly, see table_dtype.
+        - backward: Array of the same shape and dtype, backward[i, v] is the distance from v to landmark i.
+        - checksum: Checksum of the graph the tables were computed on, None to take it from graph when first needed.
+        - graph: Graph the tables were computed on, only used without a checksum.
+        """
+        self.landmarks = landmarks
+        self.forward = forward
+        self.backward = backward
+        self._checksum = checksum
+        self._graph = graph
+
+    @property
+    def checksum(self):
+        # Computed on demand, a dictionary backed Graph has to be converted to CSR for it
+        if self._checksum is None:
+            self._checksum = graph_checksum(self._graph)
+            self._graph = None
+        return self._checksum
+
+    def save(self, file_path):
+        """
+        Writes the tables to a versioned binary file tied to the graph checksum.
+        """
+        k, length = self.forward.shape
+        with open(file_path, "wb") as file:
+            header = LANDMARK_HEADER.pack(LANDMARK_MAGIC, LANDMARK_VERSION, k, length - 1, self.checksum,
+                                          self.forward.dtype.itemsize)
+            file.write(header.ljust(LANDMARK_HEADER_SIZE, b"\0"))
+            write_arrays(file, [(self.landmarks, np.int64), (self.forward, None), (self.backward, self.forward.dtype)])
+
+    @classmethod
+    def load(cls, file_path, graph=None):
+        """
+        Maps a landmark tables file written by save.
+
+        Parameters:
+        - file_path: Path of the landmark tables file.
+        - graph: Optional graph the tables are meant for. Tables computed on a different graph raise a ValueError.
+        """
+        buffer = np.memmap(file_path, dtype=np.uint8, mode="r")
+        k, num_nodes, checksum, itemsize = unpack_header(buffer, LANDMARK_HEADER, LANDMARK_HEADER_SIZE, LANDMARK_MAGIC,
+                                                         LANDMARK_VERSION, "landmark tables", file_path)
+        if itemsize not in (4, 8):
+            raise ValueError("{} has {} byte table entries, expected 4 or 8".format(file_path, itemsize))
+        if graph is not None and (checksum != graph_checksum(graph) or num_nodes != graph.num_nodes):
+            raise ValueError("{} was computed for a different graph, run the preprocessing again".format(file_path))
+
+        dtype = np.float32 if itemsize == 4 else np.float64
+        layout = [(np.int64, (k,)), (dtype, (k, num_nodes + 1)), (dtype, (k, num_nodes + 1))]
+        return cls(*map_arrays(buffer, LANDMARK_HEADER_SIZE, layout, file_path), checksum)
+
+
+def select_landmarks(graph, num_landmarks, selection="avoid", seed=None, sweeps=None, processes=1):
+    """
+    Choose landmarks for the ALT heuristic.
+
+    Parameters:
+    - graph: Graph to choose landmarks from.
+    - num_landmarks: Number of landmarks to choose.
+    - selection: "avoid" picks landmarks in regions where the current landmarks give poor bounds,
+      "farthest" repeatedly picks the vertex farthest from the landmarks chosen so far,
+      "random" picks vertices uniformly at random.
+    - seed: Optional seed for the random choices.
+    - sweeps: Optional dictionary filled with the (landmark, backward) -> distances sweeps run while selecting,
+      for landmark_tables to reuse.
+    - processes: Worker processes for the sweeps of avoid selection, None uses up to three and 1 runs in this process.
+      Each landmark depends on the ones before it, so at most three sweeps can run at once.
+
+    Returns:
+    - List of landmark node values.
+    """
+    rng = random.Random(seed)
+    sweeps = {} if sweeps is None else sweeps
+    if selection == "random":
+        return [rng.randrange(1, graph.num_nodes + 1) for _ in range(num_landmarks)]
+    if selection == "farthest":
+        return farthest_landmarks(graph, num_landmarks, rng, sweeps)
+    if selection == "avoid":
+        return avoid_landmarks(graph, num_landmarks, rng, sweeps, processes)
+    raise ValueError("Unknown landmark selection method: {}".format(selection))
+
+
+def farthest_landmarks(graph, num_landmarks, rng, sweeps):
+    """
+    Farthest point selection: the first landmark is the vertex farthest from a random start,
+    every next one maximizes the distance from the closest landmark chosen so far.
+    """
+    start = rng.randrange(1, graph.num_nodes + 1)
+    nearest = one_to_all(graph, start)
+    landmarks = []
+    for _ in range(num_landmarks):
+        candidates = np.where(np.isfinite(nearest), nearest, -1)
+        candidates[landmarks] = -1
+        landmark = int(np.argmax(candidates))
+        if candidates[landmark] < 0:
+            break
+        landmarks.append(landmark)
+        distances = sweeps[(landmark, False)] = one_to_all(graph, landmark)
+        nearest = distances if len(landmarks) == 1 else np.minimum(nearest, distances)
+    return landmarks
+
+
+def avoid_landmarks(graph, num_landmarks, rng, sweeps, processes=1):
+    """
+    Avoid selection (Goldberg and Werneck). Grow a shortest path tree from a random root, weigh every vertex
+    by how much the current landmarks underestimate its distance from the root, and take the leaf
+    at the end of the heaviest branch that does not already contain a landmark.
+    With a pool, the two sweeps of a new landmark and the tree of the next root run at the same time.
+    """
+    pool = None
+    if processes != 1:
+        pool = ProcessPoolExecutor(min(processes or 3, 3), initializer=_init_worker, initargs=(graph,))
+    try:
+        return avoid_loop(graph, num_landmarks, rng, sweeps, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def avoid_loop(graph, num_landmarks, rng, sweeps, pool):
+    reverse = graph.reverse()
+    landmarks, forward, backward = [], [], []
+    attempts = 0
+    # (root, future) of a tree grown ahead of time, the roots do not depend on the landmarks
+    pending = None
+    while len(landmarks) < num_landmarks and attempts < 10 * num_landmarks:
+        attempts += 1
+        if pending is not None:
+            root, tree = pending
+            pending = None
+            distances, parent = tree.result()
+        else:
+            root = rng.randrange(1, graph.num_nodes + 1)
+            distances, parent = one_to_all(graph, root, parents=True)
+        reached = np.isfinite(distances)
+        if reached.sum() < 2:
+            continue
+
+        weight = np.where(reached, distances, 0)
+        if landmarks:
+            from_landmark = np.array(forward)
+            to_landmark = np.array(backward)
+            with np.errstate(invalid="ignore"):
+                bounds = np.maximum(from_landmark - from_landmark[:, root:root + 1],
+                                    to_landmark[:, root:root + 1] - to_landmark)
+            bounds = np.where(np.isfinite(bounds), bounds, 0).max(axis=0)
+            weight = np.where(reached, np.maximum(weight - bounds, 0), 0)
+
+        # Accumulate subtree weights bottom up, subtrees holding a landmark weigh nothing
+        size = weight.tolist()
+        parent = parent.tolist()
+        has_landmark = [False] * len(size)
+        for landmark in landmarks:
+            has_landmark[landmark] = True
+        best_child = [0] * len(size)
+        best_size = [0] * len(size)
+        # Unreached nodes sort last at inf, keep the reached ones and visit them farthest first
+        for node in np.argsort(distances)[:int(reached.sum())][::-1].tolist():
+            if has_landmark[node]:
+                size[node] = 0
+            if node == root:
+                continue
+            node_parent = parent[node]
+            size[node_parent] += size[node]
+            has_landmark[node_parent] = has_landmark[node_parent] or has_landmark[node]
+            if size[node] > best_size[node_parent]:
+                best_size[node_parent] = size[node]
+                best_child[node_parent] = node
+
+        node = root
+        while best_child[node] and best_size[node] > 0:
+            node = best_child[node]
+        if node == root or node in landmarks:
+            continue
+
+        landmarks.append(node)
+        if pool is None:
+            forward.append(one_to_all(graph, node))
+            backward.append(one_to_all(reverse, node))
+        else:
+            futures = [pool.submit(_sweep, (node, False)), pool.submit(_sweep, (node, True))]
+            if len(landmarks) < num_landmarks:
+                root = rng.randrange(1, graph.num_nodes + 1)
+                pending = root, pool.submit(_tree, root)
+            forward.append(futures[0].result())
+            backward.append(futures[1].result())
+        sweeps[(node, False)] = forward[-1]
+        sweeps[(node, True)] = backward[-1]
+    return landmarks
+
+
+_worker_graph = None
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _sweep(task):
+    landmark, backward = task
+    graph = _worker_graph.reverse() if backward else _worker_graph
+    return one_to_all(graph, landmark)
+
+
+def _tree(root):
+    return one_to_all(_worker_graph, root, parents=True)
+
+
+def landmark_tables(graph, landmarks, processes=None, sweeps=None):
+    """
+    Distances from every landmark to every vertex and from every vertex to every landmark,
+    one Dijkstra sweep per landmark and direction, run on a process pool.
+
+    Parameters:
+    - graph: Graph the landmarks belong to.
+    - landmarks: List of landmark node values.
+    - processes: Number of worker processes, None uses every core and 1 runs in this process.
+    - sweeps: Optional dictionary of (landmark, backward) -> distances computed already, see select_landmarks.
 
+    Returns:
+    - Tuple of (forward, backward) arrays of shape (number of landmarks, number of nodes + 1).
+    """
+    sweeps = dict(sweeps or {})
+    tasks = [(landmark, backward) for backward in (False, True) for landmark in landmarks]
+    missing = [task for task in tasks if task not in sweeps]
+    if len(missing) > 1 and processes != 1:
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(graph,)) as pool:
+            sweeps.update(zip(missing, pool.map(_sweep, missing)))
+    elif missing:
+        _init_worker(graph)
+        sweeps.update(zip(missing, map(_sweep, missing)))
+    results = np.array([sweeps[task] for task in tasks]).reshape(2, len(landmarks), graph.num_nodes + 1)
+    return results[0], results[1]
@@ -5,11 +5,19 @@ import random
 from astar import AStar
 from bidirectionalAstar import BidirectionalAstar
 from landmarkAstar import LandmarkAstar
+from contractionHierarchies import ContractionHierarchies
+from graph import Graph
+from binaryGraph import load_graph
 from utils import haversine, euclidean, landmark_heuristic
 
-def run_astar_comparison(number_of_vertices, num_runs=5):
-    astar_euclidean = AStar(euclidean)
-    astar_haversine = AStar(haversine)
+# The landmark runs use the first 300 nodes only, their tables get their own file
+# so they never overwrite or get mistaken for the ones of the full graph
+PARTIAL_LIMIT = 300
+PARTIAL_LANDMARKS = "landmarks_300.bin"
+
+def run_astar_comparison(graph, number_of_vertices, num_runs=5):
+    astar_euclidean = AStar(euclidean, graph=graph)
+    astar_haversine = AStar(haversine, graph=graph)
 
     astar_euclidean_times = []
     astar_haversine_times = []
@@ -50,9 +58,9 @@ def plot_comparison(data1, data2, title, data1_label, data2_label, ylabel):
 
     plt.show()
 
-def run_bidirectional_astar_comparison(number_of_vertices, num_runs=5):
-    bstar = BidirectionalAstar(haversine)
-    astar_haversine = AStar(haversine)
+def run_bidirectional_astar_comparison(graph, number_of_vertices, num_runs=5):
+    bstar = BidirectionalAstar(haversine, graph=graph)
+    astar_haversine = AStar(haversine, graph=graph)
     astar_nodes = []
     bidirectional_astar_nodes = []
 
@@ -61,7 +69,7 @@ def run_bidirectional_astar_comparison(number_of_vertices, num_runs=5):
         destination = random.randrange(1, number_of_vertices)
 
         astar_node_count =  astar_haversine.query(source, destination).num_nodes_processed
-        bidirectional_astar_node_count = bstar.query(source, destination)[1]
+        bidirectional_astar_node_count = bstar.query(source, destination).num_nodes_processed
 
         astar_nodes.append(astar_node_count)
         bidirectional_astar_nodes.append(bidirectional_astar_node_count)
@@ -69,12 +77,31 @@ def run_bidirectional_astar_comparison(number_of_vertices, num_runs=5):
     plot_comparison(astar_nodes, bidirectional_astar_nodes, 'Comparison of Astar and BidirectionalAstar', 'AStar', 'BidirectionalAstar', 'Nodes processed')
 
 
-def run_landmark_astar_comparison():
+def run_contraction_hierarchies_comparison(graph, number_of_vertices, num_runs=5):
+    # Preprocessing the full graph takes a while, the hierarchy is reused from file once built
+    contraction_hierarchies = ContractionHierarchies(graph=graph, cache=True)
+    astar_haversine = AStar(haversine, graph=graph)
+
+    astar_times = []
+    contraction_hierarchies_times = []
+
+    for _ in range(num_runs):
+        source = random.randrange(1, number_of_vertices)
+        destination = random.randrange(1, number_of_vertices)
+
+        astar_times.append(benchmark_astar_time(astar_haversine, source, destination))
+        contraction_hierarchies_times.append(benchmark_astar_time(contraction_hierarchies, source, destination))
+
+    plot_comparison(astar_times, contraction_hierarchies_times, 'Comparison of Astar and ContractionHierarchies', 'AStar', 'ContractionHierarchies', 'Time taken (seconds)')
+
+
+def run_landmark_astar_comparison(partial_graph):
     landmark_astar_times = []
     astar_times = []
-    landmark_astar = LandmarkAstar(haversine, landmark_heuristic, 10, 300, True)
+    landmark_astar = LandmarkAstar(haversine, landmark_heuristic, 10, PARTIAL_LIMIT, True, partial_graph,
+                                   file_path=PARTIAL_LANDMARKS)
     landmark_astar_times.append(benchmark_astar_time(landmark_astar, 1, 13))
-    astar = AStar(haversine, 300)
+    astar = AStar(haversine, PARTIAL_LIMIT, partial_graph)
     astar_times.append(benchmark_astar_time(astar, 1, 13))        
     landmark_astar_times.append(benchmark_astar_time(landmark_astar, 220,221))
     astar_times.append(benchmark_astar_time(astar, 220, 221))        
@@ -83,9 +110,13 @@ def run_landmark_astar_comparison():
     
 def main():
     number_of_vertices = 264346
-    run_astar_comparison(number_of_vertices)
-    run_bidirectional_astar_comparison(number_of_vertices)
-    run_landmark_astar_comparison()
+    # Load the graph once and share it across every engine and query
+    graph = load_graph()
+    partial_graph = Graph(PARTIAL_LIMIT)
+    run_astar_comparison(graph, number_of_vertices)
+    run_bidirectional_astar_comparison(graph, number_of_vertices)
+    run_contraction_hierarchies_comparison(graph, number_of_vertices)
+    run_landmark_astar_comparison(partial_graph)
     
     #  please uncomment below lines to do see output of all algorithms 
     print("Sample test run for all algorithms: ")
@@ -93,14 +124,18 @@ def main():
     destination =  23996
     print("Running algorithms with source: {}, and destination: {}".format(source, destination))
     print("Path found by Astar:")
-    astar_haversine = AStar(haversine)
+    astar_haversine = AStar(haversine, graph=graph)
     print(astar_haversine.query(source, destination).solution())
     print("Path found by Bidirectional Astar:")
-    bstar = BidirectionalAstar(haversine)
-    print(bstar.query(source,destination)[0])
+    bstar = BidirectionalAstar(haversine, graph=graph)
+    print(bstar.query(source,destination).solution())
+    print("Path found by Contraction Hierarchies:")
+    contraction_hierarchies = ContractionHierarchies(graph=graph, cache=True)
+    print(contraction_hierarchies.query(source, destination).solution())
     
     print("Running Landmark Astar between 1 and 13: ")
-    landmark_astar = LandmarkAstar(haversine, landmark_heuristic, 10, 300, True)
+    landmark_astar = LandmarkAstar(haversine, landmark_heuristic, 10, PARTIAL_LIMIT, True, graph=partial_graph,
+                                   file_path=PARTIAL_LANDMARKS)
     print(landmark_astar.query(1,13).solution())
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+from collections import deque
+import numpy as np
+from graph import CSRGraph, build_csr
+
+# Bits per coordinate of the Hilbert curve, a 65536 x 65536 grid is finer than the spacing of road nodes in a city
+HILBERT_BITS = 16
+
+
+def hilbert_index(x, y, bits=HILBERT_BITS):
+    """
+    Position along a Hilbert curve of every (x, y) cell of a 2^bits x 2^bits grid, vectorized over arrays.
+    """
+    n = 1 << bits
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return d
+
+
+def hilbert_order(graph):
+    """
+    Node values sorted along a Hilbert curve through their coordinates, so nodes close on the map get close ids.
+    """
+    lat = np.asarray(graph.lat[1:], dtype=np.float64)
+    long = np.asarray(graph.long[1:], dtype=np.float64)
+    scale = (1 << HILBERT_BITS) - 1
+
+    def quantize(values):
+        span = values.max() - values.min() if len(values) else 0
+        return np.zeros(len(values), dtype=np.int64) if span == 0 else ((values - values.min()) / span * scale).astype(np.int64)
+
+    return np.argsort(hilbert_index(quantize(lat), quantize(long)), kind="stable") + 1
+
+
+def bfs_order(graph):
+    """
+    Node values in breadth first order over the edges taken in both directions,
+    starting again from the lowest unvisited node for every component.
+    """
+    reverse = graph.reverse()
+    order = []
+    visited = np.zeros(graph.num_nodes + 1, dtype=bool)
+    for start in range(1, graph.num_nodes + 1):
+        if visited[start]:
+            continue
+        visited[start] = True
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for neighbors in (graph.neighbors, reverse.neighbors):
+                for neighbor, _ in neighbors(node):
+                    if not visited[neighbor]:
+                        visited[neighbor] = True
+                        queue.append(neighbor)
+    return np.array(order, dtype=np.int64)
+
+
+def reorder_graph(graph, method="hilbert"):
+    """
+    Renumbers the nodes of a CSRGraph so that nodes close in the road network are close in memory.
+    Searches then touch fewer cache lines per expansion, and so do the per node arrays derived from the graph,
+    like landmark tables and search labels, once they are computed on the reordered graph.
+
+    Parameters:
+    - graph: CSRGraph with reversed edges.
+    - method: "hilbert" for a Hilbert curve through the coordinates, or "bfs" for breadth first order.
+
+    Returns:
+    - CSRGraph with every array permuted and original_ids mapping its node ids back to the DIMACS ids.
+    """
+    if method == "hilbert":
+        order = hilbert_order(graph)
+    elif method == "bfs":
+        order = bfs_order(graph)
+    else:
+        raise ValueError("Unknown reordering method: {}".format(method))
+
+    num_nodes = graph.num_nodes
+    # new_ids[old] is the new id of an old node, 0 stays unused
+    new_ids = np.zeros(num_nodes + 1, dtype=np.int64)
+    new_ids[order] = np.arange(1, num_nodes + 1)
+
+    def renumbered(offsets, targets, weights):
+        sources = np.repeat(np.arange(num_nodes + 1), np.diff(offsets))
+        return build_csr(num_nodes, new_ids[sources], new_ids[targets], weights)
+
+    lat = np.zeros(num_nodes + 1, dtype=np.int32)
+    long = np.zeros(num_nodes + 1, dtype=np.int32)
+    lat[1:] = graph.lat[order]
+    long[1:] = graph.long[order]
+    original_ids = np.zeros(num_nodes + 1, dtype=np.int32)
+    # Reordering a reordered graph maps straight back to the DIMACS ids
+    original_ids[1:] = order if graph.original_ids is None else graph.original_ids[order]
+
+    return CSRGraph(*renumbered(graph.offsets, graph.targets, graph.weights), lat, long,
+                    *renumbered(graph.reverse_offsets, graph.reverse_targets, graph.reverse_weights),
+                    limit=graph.limit, original_ids=original_ids)
@@ -0,0 +1,524 @@
+from math import inf
+from time import perf_counter
+from frontier import Frontier
+from instrumentation import PeakFrontier, search_stats
+
+# Weight below which the anytime search drops to plain A* once it improved its path
+MIN_WEIGHT = 1.05
+
+
+class SearchSpace:
+
+    def __init__(self, num_nodes):
+        """
+        Preallocated per node labels, reused by every query of an engine so that searching
+        does not allocate an object per relaxed edge.
+
+        A label is only valid when its stamp equals the current version, so resetting between
+        queries is a single increment instead of clearing every array.
+
+        Parameters:
+        - num_nodes: Highest node value of the graph.
+        """
+        size = num_nodes + 1
+        self.distance = [inf] * size
+        self.parent = [0] * size
+        self.estimate = [0] * size
+        self.stamp = [0] * size
+        self.estimated = [0] * size
+        self.settled = [0] * size
+        self.version = 0
+        self.pending = None
+
+    def reset(self):
+        """
+        Invalidates all labels. The path of the previous result is extracted first,
+        since its parent pointers are about to be overwritten.
+
+        Returns:
+        - The new version.
+        """
+        if self.pending is not None:
+            self.pending.solution()
+            self.pending = None
+        self.version += 1
+        return self.version
+
+    def path(self, destination):
+        """
+        Retraces the path to destination through the parent labels of the current version.
+        """
+        path = []
+        node = destination
+        while node:
+            path.append(node)
+            node = self.parent[node]
+        path.reverse()
+        return tuple(path)
+
+
+class SearchResult:
+
+    def __init__(self, space, destination, path_cost, stats, original_ids=None, bound=1.0):
+        """
+        Result of a query, exposing the same attributes as the destination Node used to.
+        The path is only retraced when solution() is called, or when the search space is reused.
+
+        Parameters:
+        - space: SearchSpace holding the labels of the query.
+        - destination: Destination node value.
+        - path_cost: Cost of the path found.
+        - stats: SearchStats of the query, num_nodes_processed is the number of nodes it reached.
+        - original_ids: Id map of a reordered graph, value and the path are translated back to the original ids.
+        - bound: Proven ratio between path_cost and the optimal cost, 1.0 when the path is optimal.
+        """
+        self.destination = destination
+        self.bound = bound
+        self.original_ids = original_ids
+        self.value = destination if original_ids is None else int(original_ids[destination])
+        self.path_cost = path_cost
+        self.num_nodes_processed = stats.reached
+        self.stats = stats
+        self.space = space
+        self.path = None
+        space.pending = self
+
+    def solution(self):
+        """
+        Retrieves the solution path from the source to the destination.
+        """
+        if self.path is None:
+            path = self.retrace()
+            if self.original_ids is not None:
+                path = tuple(self.original_ids[list(path)].tolist())
+            self.path = path
+            self.space = None
+        return self.path
+
+    def retrace(self):
+        """
+        Path through the graph that was searched, before translating ids.
+        """
+        return self.space.path(self.destination)
+
+
+def start_search(graph, space, source, potential, probe, budget, weight=1):
+    """
+    Prologue shared by astar_search and anytime_search: starts probe and budget, then seeds the search
+    from source, see seed_search.
+
+    Returns:
+    - Tuple of (version, neighbors, potential, frontier, on_settle) for the search loop.
+    """
+    begin_search(probe, budget)
+    return seed_search(graph, space, source, potential, probe, weight)
+
+
+def start_bidirectional_search(forward_graph, backward_graph, forward_space, backward_space, source, destination,
+                               potential, probe, budget):
+    """
+    Two-space variant of start_search, for bidirectional_search and the contraction hierarchy query.
+    The backward search is seeded from destination with the negated potential.
+
+    Returns:
+    - Tuple of the seed_search tuples of the forward and the backward search.
+    """
+    begin_search(probe, budget)
+    return (seed_search(forward_graph, forward_space, source, potential, probe),
+            seed_search(backward_graph, backward_space, destination, potential, probe, sign=-1))
+
+
+def begin_search(probe, budget):
+    """
+    Starts the counters of probe and the clock of budget, once per query.
+    """
+    if probe is not None:
+        probe.begin()
+    if budget is not None:
+        budget.begin()
+
+
+def seed_search(graph, space, source, potential, probe, weight=1, sign=1):
+    """
+    Resets the labels of one search direction, hooks probe into its neighbors, heuristic and frontier
+    and pushes source.
+
+    Parameters:
+    - potential: Heuristic of the search, None for a plain Dijkstra.
+    - weight: Weight of the heuristic in the priority of source.
+    - sign: -1 for the backward search of a bidirectional query, which uses the negated potential.
+
+    Returns:
+    - Tuple of (version, neighbors, potential, frontier, on_settle) for the search loop.
+    """
+    version = space.reset()
+    neighbors = graph.neighbors
+    frontier = Frontier()
+    on_settle = None
+    if probe is not None:
+        # The hooks get DIMACS ids like the results
+        neighbors = probe.neighbors(neighbors, graph.original_ids)
+        if potential is not None:
+            potential = probe.potential(potential)
+        frontier = PeakFrontier()
+        on_settle = probe.settle_hook(graph.original_ids)
+
+    space.stamp[source] = space.estimated[source] = version
+    space.distance[source] = 0
+    space.parent[source] = 0
+    space.estimate[source] = 0 if potential is None else sign * potential([source])[0]
+    frontier.push(weight * space.estimate[source], source)
+    return version, neighbors, potential, frontier, on_settle
+
+
+def astar_search(graph, space, source, destination, potential, probe=None, budget=None):
+    """
+    A* over the preallocated labels of a SearchSpace.
+
+    Parameters:
+    - graph: Graph or CSRGraph to search.
+    - space: SearchSpace sized for the graph, reset by this call.
+    - source: Node the search starts from.
+    - destination: Goal node.
+    - potential: Function mapping a list of node values to their heuristic values.
+      It is called once per expansion with every newly reached neighbor.
+    - probe: Optional Probe for detailed stats and hooks.
+    - budget: Optional SearchBudget. A* has no path before it reaches destination, running out raises a TimeoutError.
+
+    Returns:
+    - SearchResult, or None if destination can not be reached.
+    """
+    start = perf_counter()
+    version, neighbors, potential, frontier, on_settle = start_search(graph, space, source, potential, probe, budget)
+    distance = space.distance
+    parent = space.parent
+    estimate = space.estimate
+    stamp = space.stamp
+    estimated = space.estimated
+    settled = space.settled
+    push = frontier.push
+    pop = frontier.pop
+
+    num_reached = 1
+    num_stale = 0
+
+    while frontier:
+        node = frontier.heap[0][2]
+        if settled[node] == version:
+            # Outdated entry, the node was pushed again with a smaller cost and settled already
+            pop()
+            num_stale += 1
+            continue
+        if budget is not None and budget.exhausted():
+            # Only expansions are charged, the node stays on the frontier
+            search_stats((frontier,), num_reached, num_stale, start, probe)
+            raise budget.interrupted()
+        pop()
+        settled[node] = version
+        if on_settle is not None:
+            on_settle(node, distance[node])
+        if node == destination:
+            stats = search_stats((frontier,), num_reached, num_stale, start, probe)
+            return SearchResult(space, destination, distance[node], stats, graph.original_ids)
+
+        node_distance = distance[node]
+        reached = []
+        for neighbor, cost in neighbors(node):
+            if settled[neighbor] == version:
+                continue
+            new_distance = node_distance + cost
+            if stamp[neighbor] != version:
+                stamp[neighbor] = version
+                distance[neighbor] = new_distance
+                parent[neighbor] = node
+                reached.append(neighbor)
+            elif new_distance < distance[neighbor]:
+                distance[neighbor] = new_distance
+                parent[neighbor] = node
+                # Nodes reached during this expansion are pushed below, once their estimate is known
+                if estimated[neighbor] == version:
+                    push(new_distance + estimate[neighbor], neighbor)
+
+        if reached:
+            # The heuristic of a node never changes within a query, so it is evaluated
+            # once per node, for all neighbors reached by this expansion at once
+            num_reached += len(reached)
+            for neighbor, value in zip(reached, potential(reached)):
+                estimate[neighbor] = value
+                estimated[neighbor] = version
+                push(distance[neighbor] + value, neighbor)
+
+    search_stats((frontier,), num_reached, num_stale, start, probe)
+    return None
+
+
+class AnytimeResult(SearchResult):
+
+    def __init__(self, space, destination, path, path_cost, stats, original_ids=None, bound=1.0):
+        """
+        Result of an anytime query. Its labels keep changing after a path is found, so the path is retraced
+        as soon as it is found instead of on demand.
+        """
+        super().__init__(space, destination, path_cost, stats, original_ids, bound)
+        self.found_path = path
+
+    def retrace(self):
+        return self.found_path
+
+
+def anytime_search(graph, space, source, destination, potential, weight, probe=None, budget=None, tolerance=1.0):
+    """
+    Anytime weighted A*. Nodes are expanded in order of distance + weight * heuristic, which reaches destination
+    after far fewer expansions, on a path at most weight times the optimal cost. The search then goes on improving
+    that path: every better path halves the excess weight and reorders the open nodes, nodes whose distance + heuristic
+    can not beat the best path are pruned and nodes reached again more cheaply are expanded again.
+    min(best cost, smallest distance + heuristic of the open nodes) bounds the optimal cost from below at any time,
+    which gives the bound of the result.
+
+    Parameters:
+    - graph, space, source, destination, potential, probe: As for astar_search, the heuristic has to be admissible.
+    - weight: Weight of the heuristic, at least 1.
+    - budget: Optional SearchBudget. Running out returns the best path so far, or raises a TimeoutError without one.
+    - tolerance: Stop once the best path is proven within this factor of optimal, 1.0 refines until it is optimal.
+
+    Returns:
+    - AnytimeResult, or None if destination can not be reached.
+    """
+    if weight < 1:
+        raise ValueError("The heuristic weight must be at least 1, got {}".format(weight))
+    start = perf_counter()
+    version, neighbors, potential, frontier, on_settle = start_search(graph, space, source, potential,
+                                                                      probe, budget, weight)
+    distance = space.distance
+    parent = space.parent
+    estimate = space.estimate
+    stamp = space.stamp
+    estimated = space.estimated
+    settled = space.settled
+    push = frontier.push
+    pop = frontier.pop
+
+    best = 0 if source == destination else inf
+    best_path = (source,) if source == destination else None
+    improved = best
+    lower = 0
+    num_reached = 1
+    num_stale = 0
+    stopped = False
+
+    while frontier:
+        # Priorities never exceed weight times distance + heuristic, so the smallest one gives a lower bound
+        lower = frontier.peek() / weight
+        if best <= tolerance * lower:
+            break
+        node = frontier.heap[0][2]
+        node_distance = distance[node]
+        if settled[node] == version or node_distance + estimate[node] >= best:
+            # Outdated entry, or a node that can not lead to a better path any more
+            pop()
+            num_stale += 1
+            continue
+        if budget is not None and budget.exhausted():
+            # Only expansions are charged, the node stays on the frontier and counts for the bound
+            stopped = True
+            break
+        pop()
+        settled[node] = version
+        if on_settle is not None:
+            on_settle(node, node_distance)
+
+        reached = []
+        for neighbor, cost in neighbors(node):
+            new_distance = node_distance + cost
+            if stamp[neighbor] != version:
+                stamp[neighbor] = version
+                reached.append(neighbor)
+            elif new_distance < distance[neighbor]:
+                # Reopens settled nodes, their distance was not final
+                settled[neighbor] = 0
+                if estimated[neighbor] == version and new_distance + estimate[neighbor] < best:
+                    push(new_distance + weight * estimate[neighbor], neighbor)
+            else:
+                continue
+            distance[neighbor] = new_distance
+            parent[neighbor] = node
+            if neighbor == destination and new_distance < best:
+                best_path = space.path(destination)
+                # Nodes on the way may have been reached more cheaply since, then the path costs less than the label
+                best = sum(graph.path_cost(tail, head) for tail, head in zip(best_path, best_path[1:]))
+
+        if reached:
+            num_reached += len(reached)
+            for neighbor, value in zip(reached, potential(reached)):
+                estimate[neighbor] = value
+                estimated[neighbor] = version
+                if distance[neighbor] + value < best:
+                    push(distance[neighbor] + weight * value, neighbor)
+
+        if best < improved and weight > 1:
+            # Lower the weight for the next round, close to 1 plain A* proves optimality much sooner
+            improved = best
+            weight = 1 + (weight - 1) / 2 if weight > MIN_WEIGHT else 1
+            open_nodes = {node for _, _, node in frontier.heap
+                          if settled[node] != version and distance[node] + estimate[node] < best}
+            frontier.clear()
+            for node in open_nodes:
+                push(distance[node] + weight * estimate[node], node)
+
+    stats = search_stats((frontier,), num_reached, num_stale, start, probe)
+    if best_path is None:
+        if stopped:
+            raise budget.interrupted()
+        return None
+    if frontier:
+        # Distance + heuristic of every open node gives a tighter bound than the priorities
+        open_bound = min((distance[node] + estimate[node] for _, _, node in frontier.heap if settled[node] != version),
+                         default=inf)
+        lower = min(best, max(lower, open_bound))
+    else:
+        lower = best
+    bound = best / lower if lower > 0 else (1.0 if best == 0 else inf)
+    return AnytimeResult(space, destination, best_path, best, stats, graph.original_ids, bound)
+
+
+class BidirectionalSearchResult(SearchResult):
+
+    def __init__(self, space, backward_space, source, destination, meeting, path_cost, stats, original_ids=None,
+                 bound=1.0):
+        """
+        Result of a bidirectional query. The path is joined at the meeting node from the parent labels
+        of both search spaces, only when solution() is called or either space is reused.
+        """
+        super().__init__(space, destination, path_cost, stats, original_ids, bound)
+        self.source = source if original_ids is None else int(original_ids[source])
+        self.meeting = meeting
+        self.backward_space = backward_space
+        backward_space.pending = self
+
+    def retrace(self):
+        forward_path = self.space.path(self.meeting)
+        # The backward labels lead from the meeting node back to the destination
+        backward_path = self.backward_space.path(self.meeting)[::-1]
+        self.backward_space = None
+        return forward_path + backward_path[1:]
+
+
+def bidirectional_search(forward_graph, backward_graph, forward_space, backward_space, source, destination, potential,
+                         probe=None, budget=None):
+    """
+    Bidirectional A* with average potentials. With p(v) = (h(v, destination) - h(source, v)) / 2 the forward search
+    uses keys d_f(v) + p(v) and the backward search d_b(v) - p(v). Both searches then see the same consistent
+    reduced edge costs, so it is exact to stop once the two smallest keys add up to the best path found, mu.
+
+    Parameters:
+    - forward_graph: Graph to search from source.
+    - backward_graph: Reversed graph to search from destination.
+    - forward_space, backward_space: SearchSpaces for both directions, reset by this call.
+    - source: Node the search starts from.
+    - destination: Goal node.
+    - potential: Function mapping a list of node values to their average potentials p.
+    - probe: Optional Probe for detailed stats and hooks.
+    - budget: Optional SearchBudget. Running out returns the best path so far, or raises a TimeoutError without one.
+
+    Returns:
+    - BidirectionalSearchResult, or None if destination can not be reached.
+    """
+    start_time = perf_counter()
+    forward, backward = start_bidirectional_search(forward_graph, backward_graph, forward_space, backward_space,
+                                                   source, destination, potential, probe, budget)
+    forward_version, forward_neighbors, forward_potential, forward_frontier, on_settle = forward
+    backward_version, backward_neighbors, backward_potential, backward_frontier, _ = backward
+
+    # Cost of the best path found so far and the node where both searches met on it
+    best = [0 if source == destination else inf, source]
+    num_reached = [2]
+    num_stale = [0]
+
+    def expand(neighbors, potential, space, version, frontier, other_space, other_version, sign):
+        distance = space.distance
+        parent = space.parent
+        estimate = space.estimate
+        stamp = space.stamp
+        estimated = space.estimated
+        settled = space.settled
+        other_distance = other_space.distance
+        other_stamp = other_space.stamp
+        push = frontier.push
+
+        node = frontier.pop()[1]
+        if settled[node] == version:
+            # Outdated entry, the node was pushed again with a smaller cost and settled already
+            num_stale[0] += 1
+            return
+        settled[node] = version
+        if on_settle is not None:
+            on_settle(node, distance[node])
+
+        node_distance = distance[node]
+        reached = []
+        for neighbor, cost in neighbors(node):
+            if settled[neighbor] == version:
+                continue
+            new_distance = node_distance + cost
+            if stamp[neighbor] != version:
+                stamp[neighbor] = version
+                distance[neighbor] = new_distance
+                parent[neighbor] = node
+                reached.append(neighbor)
+            elif new_distance < distance[neighbor]:
+                distance[neighbor] = new_distance
+                parent[neighbor] = node
+                if estimated[neighbor] == version:
+                    push(new_distance + estimate[neighbor], neighbor)
+            else:
+                continue
+            # Improve mu if the other search reached the neighbor too
+            if other_stamp[neighbor] == other_version and new_distance + other_distance[neighbor] < best[0]:
+                best[0] = new_distance + other_distance[neighbor]
+                best[1] = neighbor
+
+        if reached:
+            num_reached[0] += len(reached)
+            for neighbor, value in zip(reached, potential(reached)):
+                estimate[neighbor] = sign * value
+                estimated[neighbor] = version
+                push(distance[neighbor] + sign * value, neighbor)
+
+    lower = best[0]
+    stopped = False
+    while forward_frontier and backward_frontier:
+        if budget is not None:
+            # Drop outdated entries first, so the budget is only charged for expansions
+            for space, version, frontier in ((forward_space, forward_version, forward_frontier),
+                                             (backward_space, backward_version, backward_frontier)):
+                while frontier and space.settled[frontier.heap[0][2]] == version:
+                    frontier.pop()
+                    num_stale[0] += 1
+            if not forward_frontier or not backward_frontier:
+                break
+        forward_key = forward_frontier.peek()
+        backward_key = backward_frontier.peek()
+        if forward_key + backward_key >= best[0]:
+            # No path through unsettled nodes can be shorter than mu any more
+            break
+        if budget is not None and budget.exhausted():
+            # Paths not found yet cost at least the sum of the keys
+            lower = forward_key + backward_key
+            stopped = True
+            break
+        # Expand whichever direction has the smaller key
+        if forward_key <= backward_key:
+            expand(forward_neighbors, forward_potential, forward_space, forward_version, forward_frontier, backward_space, backward_version, 1)
+        else:
+            expand(backward_neighbors, backward_potential, backward_space, backward_version, backward_frontier, forward_space, forward_version, -1)
+
+    stats = search_stats((forward_frontier, backward_frontier), num_reached[0], num_stale[0], start_time, probe)
+    if best[0] == inf:
+        if stopped:
+            raise budget.interrupted()
+        return None
+    bound = 1.0
+    if stopped:
+        bound = best[0] / lower if lower > 0 else inf
+    return BidirectionalSearchResult(forward_space, backward_space, source, destination, best[1], best[0], stats,
+                                     forward_graph.original_ids, bound)
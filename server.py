@@ -0,0 +1,333 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import constants
+from astar import AStar
+from bidirectionalAstar import BidirectionalAstar
+from binaryGraph import align, graph_arrays, graph_checksum, load_graph
+from budget import SearchBudget
+from graph import CSRGraph, Geometry
+from landmarkAstar import LandmarkAstar, LandmarkTables
+from spatialIndex import SpatialIndex, spatial_index
+from utils import haversine, landmark_heuristic
+
+ENGINES = ("astar", "bidirectional", "landmark")
+
+
+class SharedArrays:
+
+    def __init__(self, arrays):
+        """
+        Copies named arrays into a single shared memory block. Worker processes attach to the block
+        and map the arrays instead of holding a copy each, so memory stays flat as workers are added.
+
+        Parameters:
+        - arrays: Dictionary of name -> numpy array.
+        """
+        layout = []
+        size = 0
+        for name, array in arrays.items():
+            size = align(size)
+            layout.append((name, array.dtype.str, array.shape, size))
+            size += array.nbytes
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for (_, dtype, shape, offset), array in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype, self.memory.buf, offset)[...] = array
+        # Picklable description of the block, passed to the workers
+        self.descriptor = (self.memory.name, layout)
+
+    def close(self):
+        """
+        Releases the block, call once every worker is done with it.
+        """
+        self.memory.close()
+        self.memory.unlink()
+
+
+def attach_arrays(descriptor):
+    """
+    Maps the arrays of a SharedArrays block in another process.
+
+    Returns:
+    - Tuple of (SharedMemory, dictionary of name -> array). The SharedMemory has to stay referenced while the arrays are used.
+    """
+    name, layout = descriptor
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, {name: np.ndarray(shape, dtype, memory.buf, offset) for name, dtype, shape, offset in layout}
+
+
+def share_engine_data(graph, tables):
+    """
+    Puts the graph arrays, its coordinate arrays for the heuristics, its spatial index and the landmark tables
+    in shared memory.
+
+    Returns:
+    - Tuple of (SharedArrays, metadata dictionary), both needed to rebuild the engines in a worker.
+    """
+    arrays = dict(graph_arrays(graph))
+    index = spatial_index(graph)
+    geometry = graph.geometry()
+    arrays.update(index_offsets=index.offsets, index_nodes=index.nodes, index_lat=index.lat, index_long=index.long,
+                  landmarks=tables.landmarks, forward=tables.forward, backward=tables.backward,
+                  geometry_lat=geometry.lat, geometry_long=geometry.long, geometry_lat_radians=geometry.lat_radians,
+                  geometry_long_radians=geometry.long_radians, geometry_cos_lat=geometry.cos_lat)
+    metadata = {
+        "limit": graph.limit,
+        "checksum": graph_checksum(graph),
+        "index": (index.lat_min, index.long_min, index.cell_lat, index.cell_long, index.rows, index.cols),
+    }
+    return SharedArrays(arrays), metadata
+
+
+_memory = None
+_engines = None
+
+
+def _init_worker(descriptor, metadata):
+    """
+    Rebuilds the engines of a worker over the shared arrays, nothing is copied or preprocessed.
+    """
+    global _memory, _engines
+    _memory, arrays = attach_arrays(descriptor)
+    graph = CSRGraph(arrays["offsets"], arrays["targets"], arrays["weights"], arrays["lat"], arrays["long"],
+                     arrays.get("reverse_offsets"), arrays.get("reverse_targets"), arrays.get("reverse_weights"),
+                     metadata["limit"], metadata["checksum"], arrays.get("original_ids"))
+    # Hand the shared geometry and index to the graph, so the heuristics and snapping do not build them per worker
+    graph._geometry[0] = Geometry(arrays["geometry_lat"], arrays["geometry_long"], arrays["geometry_lat_radians"],
+                                  arrays["geometry_long_radians"], arrays["geometry_cos_lat"])
+    graph._spatial_index[0] = SpatialIndex(*metadata["index"], arrays["index_offsets"], arrays["index_nodes"],
+                                           arrays["index_lat"], arrays["index_long"], metadata["checksum"],
+                                           graph.original_ids)
+    tables = LandmarkTables(arrays["landmarks"], arrays["forward"], arrays["backward"], metadata["checksum"])
+    _engines = {
+        "astar": AStar(haversine, graph=graph),
+        "bidirectional": BidirectionalAstar(haversine, graph=graph),
+        "landmark": LandmarkAstar(haversine, landmark_heuristic, graph=graph, tables=tables),
+    }
+
+
+def _run_batch(batch):
+    """
+    Answers a batch of (engine, source, destination, deadline) requests in a worker.
+    Requests whose deadline passed while they were queued are skipped, the others search until their deadline
+    at most and answer with the best path found by then where the engine has one.
+
+    Returns:
+    - List of response dictionaries in batch order.
+    """
+    responses = []
+    for engine, source, destination, deadline in batch:
+        if time.time() > deadline:
+            responses.append({"error": "timeout"})
+            continue
+        try:
+            result = _engines[engine].query(source, destination, budget=SearchBudget(deadline - time.time()))
+        except TimeoutError:
+            responses.append({"error": "timeout"})
+            continue
+        except Exception as error:
+            responses.append({"error": str(error)})
+            continue
+        if result is None:
+            responses.append({"cost": None, "path": None})
+        else:
+            responses.append({"cost": float(result.path_cost), "path": list(result.solution()),
+                              "nodes_processed": result.num_nodes_processed, "bound": result.bound})
+    return responses
+
+
+class QueryServer:
+
+    def __init__(self, graph, tables, workers=None, batch_size=32, batch_delay=0.001, max_pending=1024, timeout=5.0):
+        """
+        Local routing service. Requests arrive as JSON lines over a socket and are answered by a pool of worker
+        processes running the engines over graph arrays and landmark tables in shared memory.
+
+        A request is {"id": ..., "engine": "astar" | "bidirectional" | "landmark", "source": ..., "destination": ...,
+        "timeout": optional seconds}, endpoints being node values or [lat, long] pairs in degrees. The response echoes the id
+        with cost, path, nodes_processed and the proven suboptimality bound of the path, 1.0 unless the search ran out
+        of time, or with an error such as "timeout". Responses may come out of order.
+
+        Parameters:
+        - graph: CSRGraph to serve.
+        - tables: LandmarkTables computed for graph.
+        - workers: Number of worker processes, None uses every core.
+        - batch_size: Maximum number of requests sent to a worker at once.
+        - batch_delay: Seconds to wait for more requests before sending a batch that is not full.
+        - max_pending: Queued requests at most. Once reached, reading from the clients pauses until workers catch up.
+        - timeout: Default seconds after which a request is answered with a timeout error.
+        """
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.shared, metadata = share_engine_data(graph, tables)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.shared.descriptor, metadata))
+        self.queue = None
+        self.slots = None
+        self.server = None
+        self.dispatcher = None
+
+    async def start(self, path=None, host="127.0.0.1", port=0):
+        """
+        Starts listening on a unix socket at path, or on host and port.
+        """
+        self.queue = asyncio.Queue(self.max_pending)
+        # Two batches in flight per worker keep them busy without draining the queue into the executor
+        self.slots = asyncio.Semaphore(2 * self.workers)
+        self.dispatcher = asyncio.create_task(self.dispatch())
+        # Start every worker before listening. A worker forked later would inherit the client sockets open
+        # at that moment and keep them from closing when handle is done with them
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, os.getpid) for _ in range(self.workers)))
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        """
+        Stops listening, shuts the workers down and releases the shared memory.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        self.dispatcher.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.shutdown)
+        self.shared.close()
+
+    async def handle(self, reader, writer):
+        """
+        Reads the requests of one connection. Awaiting the queue pauses reading when the server is saturated,
+        which pushes back on the client through the socket buffers.
+        """
+        tasks = set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = None
+            try:
+                request = json.loads(line)
+                engine = request["engine"]
+                if engine not in ENGINES:
+                    raise ValueError("Unknown engine: {}".format(engine))
+                source = endpoint(request["source"])
+                destination = endpoint(request["destination"])
+                timeout = float(request.get("timeout", self.timeout))
+            except (ValueError, KeyError, TypeError) as error:
+                request = request if isinstance(request, dict) else {}
+                self.write(writer, {"id": request.get("id"), "error": "Bad request: {}".format(error)})
+                continue
+
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((engine, source, destination, time.time() + timeout, future))
+            task = asyncio.create_task(self.respond(writer, request.get("id"), future, timeout))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks)
+        writer.close()
+
+    async def respond(self, writer, request_id, future, timeout):
+        try:
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # Cancels the future, the dispatcher drops it if it was not sent to a worker yet
+            response = {"error": "timeout"}
+        response["id"] = request_id
+        self.write(writer, response)
+        try:
+            await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            # The client went away, there is no one left to answer
+            pass
+
+    def write(self, writer, response):
+        if not writer.is_closing():
+            writer.write(json.dumps(response).encode() + b"\n")
+
+    async def dispatch(self):
+        """
+        Groups queued requests into batches and hands them to the workers.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.queue.qsize() < self.batch_size - 1 and self.batch_delay:
+                await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            batch = [request for request in batch if not request[-1].done()]
+            if not batch:
+                continue
+
+            await self.slots.acquire()
+            work = loop.run_in_executor(self.pool, _run_batch, [request[:-1] for request in batch])
+            work.add_done_callback(lambda work, batch=batch: self.finish(work, batch))
+
+    def finish(self, work, batch):
+        self.slots.release()
+        if work.exception() is not None:
+            responses = [{"error": "Worker failed: {}".format(work.exception())}] * len(batch)
+        else:
+            responses = work.result()
+        for request, response in zip(batch, responses):
+            future = request[-1]
+            if not future.done():
+                future.set_result(dict(response))
+
+
+def endpoint(value):
+    """
+    Node values stay as they are, [lat, long] pairs become tuples for the engines to snap.
+    """
+    if isinstance(value, list):
+        if len(value) != 2:
+            raise ValueError("Coordinates must be [lat, long]")
+        return tuple(float(coordinate) for coordinate in value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("Endpoints must be node values or [lat, long] pairs")
+    return value
+
+
+async def serve(args):
+    graph = load_graph(args.limit)
+    tables = LandmarkAstar(haversine, landmark_heuristic, args.landmarks, cache=True, graph=graph).tables
+    server = QueryServer(graph, tables, args.workers, args.batch_size, args.batch_delay, args.max_pending, args.timeout)
+    listener = await server.start(args.socket, args.host, args.port)
+    print("Serving on {}".format(args.socket or listener.sockets[0].getsockname()))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve shortest path queries to local clients.")
+    parser.add_argument("--socket", help="Path of the unix socket to listen on. Listens on host and port if not given.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on.")
+    parser.add_argument("--port", type=int, default=8642, help="Port to listen on.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, every core by default.")
+    parser.add_argument("--batch-size", type=int, default=32, help="Maximum number of requests per batch.")
+    parser.add_argument("--batch-delay", type=float, default=0.001, help="Seconds to wait for a batch to fill.")
+    parser.add_argument("--max-pending", type=int, default=1024, help="Queued requests before reading pauses.")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Default request timeout in seconds.")
+    parser.add_argument("--limit", type=int, default=None, help="Optional limit for the graph size.")
+    parser.add_argument("--landmarks", type=int, default=16, help="Number of landmarks, reusing " + constants.LANDMARK_TABLES + ".")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import os
+import struct
+from math import asin, ceil, cos, floor, pi, radians, sin, sqrt
+import numpy as np
+import constants
+from binaryGraph import graph_checksum, map_arrays, unpack_header, write_arrays
+
+# Average number of nodes per grid cell
+NODES_PER_CELL = 2
+
+
+class SpatialIndex:
+
+    def __init__(self, lat_min, long_min, cell_lat, cell_long, rows, cols, offsets, nodes, lat, long, checksum,
+                 original_ids=None):
+        """
+        Uniform grid over the fixed point coordinates of a graph, for snapping GPS coordinates to nodes.
+        DIMACS v records hold the longitude first, so the lat array of a graph is its longitudes and long its
+        latitudes. The index swaps them back: lat and long here, and every query point, are true latitude and longitude.
+        Cells are roughly square on the ground, cell (row, col) holds the nodes with
+        row = (lat - lat_min) // cell_lat and col = (long - long_min) // cell_long.
+        Lookups scan rings of cells around the query point and stop once no closer node can be in the next ring,
+        so the results are exact under the true great circle distance. The heuristics in utils read the graph
+        arrays as they are stored, so their haversine is not the same metric.
+
+        Parameters:
+        - lat_min, long_min: Fixed point coordinates of the corner of the grid.
+        - cell_lat, cell_long: Fixed point size of a cell.
+        - rows, cols: Size of the grid.
+        - offsets: int64 array of rows * cols + 1 offsets, the nodes of cell i are nodes[offsets[i]:offsets[i + 1]].
+        - nodes: int32 array of node values ordered by cell.
+        - lat, long: float64 arrays of the coordinates of nodes in radians.
+        - checksum: Checksum of the graph the index was built on.
+        - original_ids: original_ids of a reordered graph. nodes holds node ids, the lookups return DIMACS ids.
+        """
+        self.lat_min = lat_min
+        self.long_min = long_min
+        self.cell_lat = cell_lat
+        self.cell_long = cell_long
+        self.rows = rows
+        self.cols = cols
+        self.offsets = offsets
+        self.nodes = nodes
+        self.lat = lat
+        self.long = long
+        self.cos_lat = np.cos(lat)
+        self.checksum = checksum
+        self.original_ids = original_ids
+        self._offsets = memoryview(offsets)
+        # Largest |lat| of the grid, where a degree of long is shortest on the ground
+        self.max_abs_lat = max(abs(lat_min), abs(lat_min + rows * cell_lat)) / constants.M
+
+    @classmethod
+    def build(cls, graph):
+        """
+        Buckets every node with coordinates into a grid sized for NODES_PER_CELL nodes per cell.
+        """
+        geometry = graph.geometry()
+        nodes = np.arange(1, graph.num_nodes + 1)
+        # Nodes without coordinates are left at 0, 0
+        nodes = nodes[(geometry.lat[1:] != 0) | (geometry.long[1:] != 0)]
+        # The graph arrays are swapped, see __init__
+        lat = geometry.long[nodes]
+        long = geometry.lat[nodes]
+        if len(nodes):
+            lat_min, long_min = lat.min(), long.min()
+            lat_span, long_span = lat.max() - lat_min + 1, long.max() - long_min + 1
+        else:
+            lat_min = long_min = 0.0
+            lat_span = long_span = 1.0
+
+        # Cells of equal ground size: a degree of long shrinks with cos(lat)
+        scale = max(cos(radians((lat_min + lat_span / 2) / constants.M)), 1e-6)
+        cell = sqrt(lat_span * long_span * scale * NODES_PER_CELL / max(len(nodes), 1))
+        cell_lat, cell_long = cell, cell / scale
+        rows, cols = max(ceil(lat_span / cell_lat), 1), max(ceil(long_span / cell_long), 1)
+
+        row = np.minimum(((lat - lat_min) // cell_lat).astype(np.int64), rows - 1)
+        col = np.minimum(((long - long_min) // cell_long).astype(np.int64), cols - 1)
+        cells = row * cols + col
+        order = np.argsort(cells, kind="stable")
+        offsets = np.zeros(rows * cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=rows * cols), out=offsets[1:])
+        nodes = nodes[order].astype(np.int32)
+        return cls(float(lat_min), float(long_min), float(cell_lat), float(cell_long), rows, cols, offsets, nodes,
+                   geometry.long_radians[nodes], geometry.lat_radians[nodes], graph_checksum(graph), graph.original_ids)
+
+    def nearest(self, lat, long, k=1):
+        """
+        Finds the k nodes closest to a point.
+
+        Parameters:
+        - lat, long: Latitude and longitude of the point in degrees.
+        - k: Number of nodes to return.
+
+        Returns:
+        - Tuple of (nodes, distances in km), both sorted by distance. Fewer than k when the graph is smaller.
+        """
+        return self.search(lat, long, k=k)
+
+    def within(self, lat, long, radius):
+        """
+        Finds every node within radius km of a (lat, long) point in degrees, sorted by distance.
+
+        Returns:
+        - Tuple of (nodes, distances in km).
+        """
+        return self.search(lat, long, radius=radius)
+
+    def snap(self, points):
+        """
+        Snaps a batch of points to their nearest nodes.
+
+        Parameters:
+        - points: Array like of shape (m, 2) holding (lat, long) pairs in degrees.
+
+        Returns:
+        - Tuple of (int64 array of nodes, float64 array of distances in km), 0 and inf for an empty graph.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        nodes = np.zeros(len(points), dtype=np.int64)
+        distances = np.full(len(points), np.inf)
+        for i, (lat, long) in enumerate(points.tolist()):
+            found, found_distances = self.search_nodes(lat, long, k=1)
+            if len(found):
+                nodes[i] = found[0]
+                distances[i] = found_distances[0]
+        return self.translated(nodes), distances
+
+    def search(self, lat, long, k=None, radius=None):
+        """
+        Ring search shared by nearest and within, stopping at k nodes or at radius km.
+
+        Returns:
+        - Tuple of (nodes, distances in km), with the DIMACS ids of a reordered graph.
+        """
+        nodes, distances = self.search_nodes(lat, long, k, radius)
+        return self.translated(nodes), distances
+
+    def translated(self, nodes):
+        """
+        DIMACS ids of an array of node ids, 0 stays 0.
+        """
+        if self.original_ids is None:
+            return nodes
+        return self.original_ids[nodes].astype(np.int64)
+
+    def search_nodes(self, lat, long, k=None, radius=None):
+        """
+        search returning the node ids of the graph, which differ from the DIMACS ids on a reordered graph.
+        For snap, which hands the node straight to an engine.
+        """
+        fixed_lat, fixed_long = lat * constants.M, long * constants.M
+        lat_radians, long_radians = radians(lat), radians(long)
+        cos_lat = cos(lat_radians)
+        row = floor((fixed_lat - self.lat_min) / self.cell_lat)
+        col = floor((fixed_long - self.long_min) / self.cell_long)
+        # Lower bounds on the distance to a cell d cells away, from the lat and the long difference.
+        # haversine is at least R * dlat, and at least 2R * asin(cos_min * sin(dlong / 2)) with cos_min the
+        # smallest cos(lat) either point can have
+        cos_min = cos(radians(min(max(self.max_abs_lat, abs(lat)), 90)))
+        lat_step = radians(self.cell_lat / constants.M) * constants.RADIUS
+        long_step = radians(self.cell_long / constants.M)
+        # Rings past this one are entirely outside the grid
+        last_ring = max(abs(row), abs(row - self.rows + 1), abs(col), abs(col - self.cols + 1))
+
+        found_nodes = []
+        found_distances = []
+        count = 0
+        for ring in range(last_ring + 1):
+            ranges = self.ring_ranges(row, col, ring)
+            if ranges:
+                indices = np.concatenate([np.arange(start, end) for start, end in ranges])
+                a = (np.sin((self.lat[indices] - lat_radians) / 2) ** 2 +
+                     self.cos_lat[indices] * cos_lat * np.sin((self.long[indices] - long_radians) / 2) ** 2)
+                distances = 2 * constants.RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+                if radius is not None:
+                    indices, distances = indices[distances <= radius], distances[distances <= radius]
+                found_nodes.append(self.nodes[indices])
+                found_distances.append(distances)
+                count += len(indices)
+
+            # Closest possible distance of a node in the next ring, separated from the point by ring full cells
+            bound = min(ring * lat_step, 2 * constants.RADIUS * asin(cos_min * sin(min(ring * long_step, pi) / 2)))
+            if radius is not None and bound > radius:
+                break
+            if k is not None and count >= k and bound >= np.partition(np.concatenate(found_distances), k - 1)[k - 1]:
+                break
+
+        if not found_nodes:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        nodes = np.concatenate(found_nodes).astype(np.int64)
+        distances = np.concatenate(found_distances)
+        order = np.argsort(distances, kind="stable")[:k]
+        return nodes[order], distances[order]
+
+    def ring_ranges(self, row, col, ring):
+        """
+        Index ranges into nodes of the cells at Chebyshev distance ring from (row, col), clipped to the grid.
+        The cells of a row are contiguous, so the top and bottom edges of a ring are a single range each.
+        """
+        offsets = self._offsets
+        ranges = []
+        first_col, last_col = max(col - ring, 0), min(col + ring, self.cols - 1)
+        if first_col > last_col:
+            return ranges
+        for r in range(max(row - ring, 0), min(row + ring, self.rows - 1) + 1):
+            base = r * self.cols
+            if ring == 0 or abs(r - row) == ring:
+                start, end = offsets[base + first_col], offsets[base + last_col + 1]
+                if start < end:
+                    ranges.append((start, end))
+            else:
+                for c in (col - ring, col + ring):
+                    if 0 <= c < self.cols and offsets[base + c] < offsets[base + c + 1]:
+                        ranges.append((offsets[base + c], offsets[base + c + 1]))
+        return ranges
+
+    def save(self, file_path):
+        """
+        Writes the index to a versioned binary file tied to the graph checksum.
+        """
+        with open(file_path, "wb") as file:
+            header = SPATIAL_HEADER.pack(SPATIAL_MAGIC, SPATIAL_VERSION, len(self.nodes), self.rows, self.cols,
+                                         self.checksum, self.lat_min, self.long_min, self.cell_lat, self.cell_long)
+            file.write(header.ljust(SPATIAL_HEADER_SIZE, b"\0"))
+            write_arrays(file, [(self.offsets, np.int64), (self.nodes, np.int32),
+                                (self.lat, np.float64), (self.long, np.float64)])
+
+    @classmethod
+    def load(cls, file_path, graph=None):
+        """
+        Maps a spatial index file written by save.
+
+        Parameters:
+        - file_path: Path of the spatial index file.
+        - graph: Optional graph the index is meant for. An index built on a different graph raises a ValueError.
+        """
+        buffer = np.memmap(file_path, dtype=np.uint8, mode="r")
+        fields = unpack_header(buffer, SPATIAL_HEADER, SPATIAL_HEADER_SIZE, SPATIAL_MAGIC, SPATIAL_VERSION,
+                               "spatial index", file_path)
+        count, rows, cols, checksum, lat_min, long_min, cell_lat, cell_long = fields
+        if graph is not None and checksum != graph_checksum(graph):
+            raise ValueError("{} was built for a different graph, build it again".format(file_path))
+
+        layout = [(np.int64, rows * cols + 1), (np.int32, count), (np.float64, count), (np.float64, count)]
+        arrays = map_arrays(buffer, SPATIAL_HEADER_SIZE, layout, file_path)
+        return cls(lat_min, long_min, cell_lat, cell_long, rows, cols, *arrays, checksum,
+                   None if graph is None else graph.original_ids)
+
+
+# Header layout: magic, version, number of indexed nodes, rows, cols, graph checksum, grid corner and cell size
+SPATIAL_MAGIC = b"ASPSPIDX"
+SPATIAL_VERSION = 2
+SPATIAL_HEADER = struct.Struct("<8sIQIII4d")
+SPATIAL_HEADER_SIZE = 64
+
+
+def spatial_index(graph, file_path=constants.SPATIAL_INDEX):
+    """
+    The spatial index of a graph, loaded from file_path if it was saved for this graph and built otherwise.
+    It is kept on the graph, so it is only loaded or built once.
+    """
+    if graph._spatial_index[0] is None:
+        index = None
+        if os.path.exists(file_path):
+            try:
+                index = SpatialIndex.load(file_path, graph)
+            except ValueError:
+                pass
+        graph._spatial_index[0] = index if index is not None else SpatialIndex.build(graph)
+    return graph._spatial_index[0]
+
+
+def snap(graph, point):
+    """
+    Maps a query endpoint to a node of graph: (lat, long) tuples in degrees, latitude first, are snapped to the nearest node,
+    node values are returned unchanged, or translated to the node ids of a reordered graph.
+    """
+    if isinstance(point, tuple):
+        nodes, _ = spatial_index(graph).search_nodes(*point, k=1)
+        if not len(nodes):
+            raise ValueError("Cannot snap {} to a graph without coordinates".format(point))
+        return int(nodes[0])
+    if graph.internal_ids is not None:
+        return int(graph.internal_ids[point])
+    return point
@@ -0,0 +1,207 @@
+import copy
+from heapq import heappush
+import numpy as np
+from bidirectionalAstar import BidirectionalAstar
+from contractionHierarchies import ContractionHierarchies
+from dijkstra import settle
+from graph import CSRGraph
+from landmarkAstar import LandmarkAstar, LandmarkTables
+
+
+class TrafficUpdater:
+
+    def __init__(self, engines, router=None):
+        """
+        Applies batches of live arc weight changes to engines sharing one graph, without preprocessing again.
+
+        Every batch produces a new snapshot of the graph (and of the landmark tables when they need a repair),
+        the previous ones are never modified. Queries already running keep searching the snapshot they started on,
+        queries started after the update see the new one.
+
+        Parameters:
+        - engines: AStar, BidirectionalAstar and LandmarkAstar instances sharing a graph.
+          A ContractionHierarchies raises a ValueError, its shortcuts would have to be computed again.
+        - router: Optional CachedRouter around one of the engines, its stale entries are invalidated.
+        """
+        self.engines = list(engines)
+        self.router = router
+        if router is not None and router.engine not in self.engines:
+            self.engines.append(router.engine)
+        if not self.engines:
+            raise ValueError("No engines to update")
+        for engine in self.engines:
+            if isinstance(engine, ContractionHierarchies):
+                raise ValueError("Contraction hierarchies can not be updated in place, build the hierarchy again")
+        self.graph = self.engines[0].graph
+        self.num_changes = 0
+
+    def update(self, updates):
+        """
+        Applies a batch of weight changes.
+
+        Parameters:
+        - updates: Iterable of (tail, head, new cost) for existing arcs.
+
+        Returns:
+        - List of (tail, head, old cost, new cost) for the arcs whose cost actually changed.
+        """
+        graph, changes = update_weights(self.graph, updates)
+        original_ids = graph.original_ids
+        if not changes:
+            return changes
+
+        # Engines sharing tables get the same repaired tables
+        repaired = {}
+        for engine in self.engines:
+            if isinstance(engine, LandmarkAstar) and id(engine.tables) not in repaired:
+                repaired[id(engine.tables)] = repair_landmarks(engine.tables, graph, changes)
+
+        for engine in self.engines:
+            if isinstance(engine, LandmarkAstar):
+                # Tables first: after a batch that only lowers costs, the repaired tables are valid for the old
+                # snapshot too. Batches that also raise costs give tables that may overestimate on the old snapshot
+                engine.tables = repaired[id(engine.tables)]
+            if isinstance(engine, BidirectionalAstar):
+                engine.backward_graph = graph.reverse()
+                engine.forward_graph = graph
+            engine.graph = graph
+        if self.router is not None:
+            self.router.invalidate(changes, graph)
+        self.graph = graph
+        self.num_changes += len(changes)
+        if original_ids is not None:
+            # Report the arcs with the ids they were given with
+            return [(int(original_ids[tail]), int(original_ids[head]), old, new) for tail, head, old, new in changes]
+        return changes
+
+
+def update_weights(graph, updates):
+    """
+    Applies a batch of arc weight changes copy on write, the given graph is left untouched.
+
+    Parameters:
+    - graph: Graph or CSRGraph.
+    - updates: Iterable of (tail, head, new cost) for existing arcs. Missing arcs raise a KeyError.
+      Node values are DIMACS ids, also for a reordered graph.
+
+    Returns:
+    - Tuple of (updated graph, list of (tail, head, old cost, new cost) for the arcs whose cost changed).
+      The changes use the node ids of graph, which differ from the DIMACS ids once it is reordered.
+    """
+    if graph.internal_ids is not None:
+        internal_ids = graph.internal_ids
+        updates = [(int(internal_ids[tail]), int(internal_ids[head]), cost) for tail, head, cost in updates]
+    if isinstance(graph, CSRGraph):
+        return update_csr_weights(graph, updates)
+    return update_dict_weights(graph, updates)
+
+
+def update_csr_weights(graph, updates):
+    """
+    Copies the weight arrays once per batch, only a few MB even for the whole city, and shares every other array.
+    """
+    reverse = graph.reverse() if graph.reverse_offsets is not None else None
+    # Copies are writable, also when the graph is mapped read only from a binary file
+    weights = np.array(graph.weights)
+    reverse_weights = np.array(graph.reverse_weights) if reverse is not None else None
+    changes = []
+    for tail, head, cost in updates:
+        cost = checked_cost(cost)
+        index = graph.edge_index(tail, head)
+        old = int(weights[index])
+        if old == cost:
+            continue
+        weights[index] = cost
+        if reverse is not None:
+            reverse_weights[reverse.edge_index(head, tail)] = cost
+        changes.append((tail, head, old, cost))
+
+    updated = copy.copy(graph)
+    updated.weights = weights
+    updated.reverse_weights = reverse_weights
+    updated.checksum = None
+    updated._bind_views()
+    return updated, changes
+
+
+def update_dict_weights(graph, updates):
+    """
+    Copies the outer dictionaries and the inner dictionaries of the changed arcs only.
+    """
+    distances = dict(graph.distances)
+    reverse_distances = dict(graph.reverse_distances)
+    copied = set()
+    changes = []
+    for tail, head, cost in updates:
+        cost = checked_cost(cost)
+        old = distances.get(tail, {})[head]
+        if old == cost:
+            continue
+        if (tail, True) not in copied:
+            distances[tail] = dict(distances[tail])
+            copied.add((tail, True))
+        if (head, False) not in copied:
+            reverse_distances[head] = dict(reverse_distances[head])
+            copied.add((head, False))
+        distances[tail][head] = cost
+        reverse_distances[head][tail] = cost
+        changes.append((tail, head, old, cost))
+
+    updated = copy.copy(graph)
+    updated.distances = distances
+    updated.reverse_distances = reverse_distances
+    updated.checksum = None
+    return updated, changes
+
+
+def checked_cost(cost):
+    if cost < 0 or cost != int(cost):
+        raise ValueError("Arc costs must be non negative integers, got {}".format(cost))
+    return int(cost)
+
+
+def repair_landmarks(tables, graph, changes):
+    """
+    Keeps landmark tables valid for the ALT heuristic after weight changes.
+
+    ALT only needs every row of the tables to be a feasible potential: forward[i, v] <= forward[i, u] + w(u, v)
+    and backward[i, u] <= w(u, v) + backward[i, v] for every arc, which exact distances are. Increases keep that true,
+    the bounds just get weaker. Decreases are propagated with a Dijkstra from the endpoints of the decreased arcs
+    that lowers labels until every arc is satisfied again, which gives the exact new distances when the tables were
+    exact and only visits the part of the landmark trees the decreases improve.
+
+    Parameters:
+    - tables: LandmarkTables valid for the graph before the changes.
+    - graph: Graph after the changes.
+    - changes: List of (tail, head, old cost, new cost).
+
+    Returns:
+    - New tables for graph, sharing the arrays of the given ones if no arc got cheaper. The given tables are never
+      modified. The checksum of graph is only computed once something asks for it, such as saving the tables.
+    """
+    decreases = [(tail, head, new) for tail, head, old, new in changes if new < old]
+    if not decreases:
+        return LandmarkTables(tables.landmarks, tables.forward, tables.backward, None, graph)
+    # Lowering labels never needs more precision than the tables were stored with, see table_dtype
+    forward = np.array(tables.forward)
+    backward = np.array(tables.backward)
+    reverse = graph.reverse()
+    for i in range(len(tables.landmarks)):
+        propagate(graph, forward[i], decreases)
+        propagate(reverse, backward[i], [(head, tail, cost) for tail, head, cost in decreases])
+    return LandmarkTables(tables.landmarks, forward, backward, None, graph)
+
+
+def propagate(graph, labels, arcs):
+    """
+    Lowers labels in place so that labels[head] <= labels[tail] + cost holds again for every arc of graph,
+    given that it only fails for the listed (tail, head, cost) arcs.
+    """
+    labels = memoryview(labels)
+    heap = []
+    for tail, head, cost in arcs:
+        if labels[tail] + cost < labels[head]:
+            labels[head] = labels[tail] + cost
+            heappush(heap, (labels[head], head))
+    for _ in settle(graph.neighbors, heap, labels):
+        pass
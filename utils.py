@@ -1,5 +1,7 @@
 import constants
-from math import inf, radians, cos, sin, asin, sqrt, dist
+import numpy as np
+from dimacs import read_records
+from math import inf, radians, cos, sin, asin, sqrt, dist, hypot
 
 
 def load_file_into_dict(file_path, delimiter, limit=None):
@@ -7,30 +9,31 @@ def load_file_into_dict(file_path, delimiter, limit=None):
     Loads dimacs data from a file into a dictionary.
 
     Parameters:
-        - file_path: Path to the file.
+        - file_path: Path to the file, .gz and .bz2 files are decompressed on the fly.
         - delimiter: Character that separates actual data from comments and metadata in the file.
         - limit: Optional parameter to limit the number of numbers loaded from files.
     Returns:
         - A dictionary containing the data from the file.
     """
 
+    # Records are parsed in large chunks with NumPy and filtered on the arrays
+    records = read_records(file_path, delimiter.encode())
     result = {}
-    with open(file_path) as file:
-        for line in file:
-            if line.startswith(delimiter):
-                
-                # Handle coordinates data
-                if delimiter == "v": 
-                    key, lat, long = map(int, line.split()[1:])
-                    if not limit or key <= limit:
-                        result[key] = {"lat": lat, "long": long}
-                
-                # Handle distance data
-                elif delimiter == "a":
-                    source, destination, cost = map(int, line.split()[1:])
-                    if not limit or (source  <= limit and destination <= limit) :
-                        result.setdefault(source, {})[destination] = cost
-    
+
+    # Handle coordinates data
+    if delimiter == "v":
+        if limit:
+            records = records[records[:, 0] <= limit]
+        for key, lat, long in records.tolist():
+            result[key] = {"lat": lat, "long": long}
+
+    # Handle distance data
+    elif delimiter == "a":
+        if limit:
+            records = records[(records[:, 0] <= limit) & (records[:, 1] <= limit)]
+        for source, destination, cost in records.tolist():
+            result.setdefault(source, {})[destination] = cost
+
     # Ensure all nodes up to the limit are present in the result dictionary
     #To be useful in preprocessing
     if limit:
@@ -68,39 +71,119 @@ def haversine(source, destination):
 
 
 
-def landmark_heuristic(landmarks, landmarks_dict, vertex_dict, node, destination):
+def landmark_heuristic(tables, nodes, destination, active=None):
     """
     Heuristic value for landmarks  A* search algorithm.
+    By the triangle inequality d(L, t) - d(L, v) and d(v, L) - d(t, L) are lower bounds on d(v, t)
+    for every landmark L, the tightest of them across landmarks is the heuristic.
 
     Parameters:
-        - landmarks: List of landmarks.
-        - landmarks_dict: Dictionary containing distances from all landmark to every vertex  distances.
-        - vertex_dict: Dictionary containing distances from all vertex to every landmark.
-        - node: The current node in the search.
+        - tables: LandmarkTables with the forward and backward landmark distances.
+        - nodes: A node value, or an array of node values to evaluate in one go.
         - destination: The destination node.
+        - active: Optional array of landmark indices to restrict the bound to.
+    Returns:
+        - The lower bound as a float, or an array of bounds when nodes is an array.
     """
-    min_distance = inf / constants.M
-
-    for landmark in landmarks:
-        if landmark in vertex_dict[node.value] and destination in landmarks_dict[landmark]:
-            distance = abs(vertex_dict[node.value][landmark] - landmarks_dict[landmark][destination])
-            min_distance = min(min_distance, distance)
-
-    return min_distance
+    forward = tables.forward
+    backward = tables.backward
+    rows = slice(None) if active is None else active
+    from_landmark = forward[rows, destination]
+    to_landmark = backward[rows, destination]
+
+    scalar = np.ndim(nodes) == 0
+    nodes = np.atleast_1d(nodes)
+    if active is None:
+        forward, backward = forward[:, nodes], backward[:, nodes]
+    else:
+        forward, backward = forward[np.ix_(active, nodes)], backward[np.ix_(active, nodes)]
+
+    # Unreachable entries are inf, inf - inf gives nan which fmax skips. Starting the reduction
+    # at 0 also clamps negative bounds
+    with np.errstate(invalid="ignore"):
+        bounds = np.fmax(from_landmark[:, None] - forward, backward - to_landmark[:, None])
+        bounds = np.fmax.reduce(bounds, axis=0, initial=0)
+    return float(bounds[0]) if scalar else bounds
+
+
+def best_landmarks(tables, source, destination, count):
+    """
+    Indices of the count landmarks that give the tightest bound between source and destination.
+    Restricting a query to them keeps most of the pruning at a fraction of the cost per node.
+    """
+    with np.errstate(invalid="ignore"):
+        bounds = np.fmax(tables.forward[:, destination] - tables.forward[:, source],
+                         tables.backward[:, source] - tables.backward[:, destination])
+    bounds = np.where(np.isnan(bounds), -inf, bounds)
+    return np.sort(np.argsort(-bounds, kind="stable")[:count])
 
 def euclidean(source, destination):
     return dist([source['lat'], source['long']], [destination['lat'], destination['long']])
 
 
-def f(h, graph, node):
+def geometric_potential(h, graph, destination):
     """
-    Total cost function for A* search algorithm.
+    Per query heuristic for A* search algorithm, mapping a list of node values to
+    the heuristic distances from their coordinates to the destination.
+    haversine and euclidean run on the precomputed coordinate arrays of the graph,
+    any other heuristic is called on the coordinate dictionaries.
     """
-    return h(graph.coordinates[node.value], graph.coordinates[graph.destination]) + node.path_cost
+    if h is haversine:
+        return haversine_potential(graph, destination)
+    if h is euclidean:
+        return euclidean_potential(graph, destination)
+    coordinates = graph.coordinates
+    target = coordinates[destination]
+    return lambda nodes: [h(coordinates[node], target) for node in nodes]
+
+
+# Below this many nodes a Python loop over memoryviews beats the overhead of a NumPy call
+BATCH_SIZE = 16
+
+
+def haversine_potential(graph, destination):
+    """
+    haversine to the destination over precomputed radians and cos(lat) arrays.
+    The destination terms are computed once, batches of BATCH_SIZE nodes or more are scored in one NumPy call.
+    """
+    geometry = graph.geometry()
+    lat, long, cos_lat = geometry.lat_radians, geometry.long_radians, geometry.cos_lat
+    lat_view, long_view, cos_lat_view = memoryview(lat), memoryview(long), memoryview(cos_lat)
+    lat2, lon2, cos_lat2 = lat_view[destination], long_view[destination], cos_lat_view[destination]
+    diameter = 2 * constants.RADIUS
+
+    def potential(nodes):
+        if len(nodes) < BATCH_SIZE:
+            return [diameter * asin(sqrt(sin((lat2 - lat_view[node]) / 2) ** 2 +
+                                         cos_lat_view[node] * cos_lat2 * sin((lon2 - long_view[node]) / 2) ** 2))
+                    for node in nodes]
+        nodes = np.asarray(nodes)
+        a = np.sin((lat2 - lat[nodes]) / 2) ** 2 + cos_lat[nodes] * cos_lat2 * np.sin((lon2 - long[nodes]) / 2) ** 2
+        return (diameter * np.arcsin(np.sqrt(a))).tolist()
+
+    return potential
+
+
+def euclidean_potential(graph, destination):
+    """
+    euclidean to the destination over the precomputed coordinate arrays, batched like haversine_potential.
+    """
+    geometry = graph.geometry()
+    lat, long = geometry.lat, geometry.long
+    lat_view, long_view = memoryview(lat), memoryview(long)
+    lat2, lon2 = lat_view[destination], long_view[destination]
+
+    def potential(nodes):
+        if len(nodes) < BATCH_SIZE:
+            return [hypot(lat_view[node] - lat2, long_view[node] - lon2) for node in nodes]
+        nodes = np.asarray(nodes)
+        return np.hypot(lat[nodes] - lat2, long[nodes] - lon2).tolist()
+
+    return potential
 
 
-def f2(h, landmarks, landmarks_dict, vertex_dict, node, destination):
+def landmark_potential(h, tables, destination, active=None):
     """
-    Total cost function for landmarks A* search algorithm.
+    Per query heuristic for landmarks A* search algorithm, evaluating a list of node values in one call.
     """
-    return h(landmarks, landmarks_dict, vertex_dict, node, destination) + node.path_cost
+    return lambda nodes: h(tables, np.array(nodes), destination, active).tolist()